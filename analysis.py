@@ -0,0 +1,289 @@
+import concurrent.futures
+import json
+import logging
+import pathlib
+import sqlite3
+import zlib
+from datetime import datetime
+
+import numpy as np
+
+logger = logging.getLogger("bend_tester")
+
+TUBE_COLUMNS = (
+    "box",
+    "date",
+    "time",
+    "operator",
+    "tube_id",
+    "status",
+    "up_pix",
+    "low_pix",
+    "dy",
+    "threshold",
+    "unit_x",
+)
+TRANSITION_COLUMNS = (
+    "box",
+    "tube_id",
+    "time",
+    "from_state",
+    "to_state",
+    "period",
+    "cause",
+)
+STR_COLUMNS = ("box", "operator", "status")
+FLOAT_COLUMNS = ("up_pix", "low_pix", "dy", "threshold", "unit_x")
+CACHE_DIR = ".cache"
+ARCHIVE_VERSION = 1
+
+
+def parse_date(values) -> np.ndarray:
+    """Converts "YYYY/MM/DD" strings to datetime64[D] array"""
+    return np.array([str(v).replace("/", "-") for v in values], dtype="datetime64[D]")
+
+
+def parse_time(values) -> np.ndarray:
+    """Converts "HH:MM:SS" strings to seconds of day"""
+    out = np.zeros(len(values), dtype=np.int32)
+    for i, v in enumerate(values):
+        h, m, s = str(v).split(":")
+        out[i] = int(h) * 3600 + int(m) * 60 + int(s)
+    return out
+
+
+def read_box_db(db_path) -> dict:
+    """Reads [tubes] table of one box database into typed NumPy column arrays
+
+    Returns:
+        dict: column name -> array, "date" is datetime64[D], "time" is seconds of day
+    """
+    con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        rows = con.execute(f"SELECT {', '.join(TUBE_COLUMNS)} FROM tubes").fetchall()
+    finally:
+        con.close()
+    cols = list(zip(*rows)) if rows else [[] for _ in TUBE_COLUMNS]
+    data = {}
+    for name, values in zip(TUBE_COLUMNS, cols):
+        if name in STR_COLUMNS:
+            data[name] = np.array([str(v) for v in values], dtype=str)
+        elif name in FLOAT_COLUMNS:
+            data[name] = np.array(
+                [np.nan if v is None else v for v in values], dtype=np.float64
+            )
+        elif name == "tube_id":
+            data[name] = np.array(values, dtype=np.int64)
+        elif name == "date":
+            data[name] = parse_date(values)
+        elif name == "time":
+            data[name] = parse_time(values)
+    return data
+
+
+def unix_to_date(values) -> np.ndarray:
+    """Converts unix times to local datetime64[D] array"""
+    return parse_date([datetime.fromtimestamp(v).strftime("%Y/%m/%d") for v in values])
+
+
+def read_transitions(db_path) -> dict:
+    """Reads [transitions] table of one box database into column arrays
+
+    Returns:
+        dict: column name -> array, empty arrays for databases without table
+    """
+    con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        rows = con.execute(
+            f"SELECT {', '.join(TRANSITION_COLUMNS)} FROM transitions"
+        ).fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    finally:
+        con.close()
+    cols = list(zip(*rows)) if rows else [[] for _ in TRANSITION_COLUMNS]
+    data = {}
+    for name, values in zip(TRANSITION_COLUMNS, cols):
+        if name == "tube_id":
+            data[name] = np.array(values, dtype=np.int64)
+        elif name in ("time", "period"):
+            data[name] = np.array(values, dtype=np.float64)
+        else:
+            data[name] = np.array([str(v) for v in values], dtype=str)
+    return data
+
+
+def load_transitions(run_dir="run", pattern="*.db", workers=None) -> dict:
+    """Loads state transitions of all box databases, sorted by time"""
+    db_paths = sorted(pathlib.Path(run_dir).glob(pattern))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(read_transitions, db_paths))
+    if not results:
+        results = [{name: np.array([]) for name in TRANSITION_COLUMNS}]
+    data = {
+        name: np.concatenate([r[name] for r in results]) for name in TRANSITION_COLUMNS
+    }
+    return select(data, np.argsort(data["time"], kind="stable"))
+
+
+def read_traces(db_path, tube_id) -> list:
+    """Reads x traces recorded for a tube (one per measurement)
+
+    Returns:
+        list: (t, x) array tuples, t in seconds from first sample
+    """
+    con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        rows = con.execute(
+            "SELECT trace FROM tubes WHERE tube_id = ? AND trace IS NOT NULL",
+            (tube_id,),
+        ).fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    finally:
+        con.close()
+    return [decode_trace(row[0]) for row in rows]
+
+
+def decode_trace(blob):
+    """Decodes x trace blob of tubes table written by Tube_Cache
+
+    Returns:
+        tuple: (t, x) arrays, t in seconds from the first sample
+    """
+    pairs = np.frombuffer(zlib.decompress(blob), dtype=np.float32).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def get_file_key(db_path) -> np.ndarray:
+    """Returns mtime/size signature of database (including WAL file)"""
+    key = []
+    for path in (pathlib.Path(db_path), pathlib.Path(f"{db_path}-wal")):
+        if path.exists():
+            stat = path.stat()
+            key += [stat.st_mtime_ns, stat.st_size]
+        else:
+            key += [0, 0]
+    return np.array(key, dtype=np.int64)
+
+
+def load_box_db(db_path, use_cache=True) -> dict:
+    """Loads box database, reusing the on-disk cache if database is unchanged"""
+    db_path = pathlib.Path(db_path)
+    cache_path = db_path.parent / CACHE_DIR / f"{db_path.stem}.npz"
+    key = get_file_key(db_path)
+    if use_cache and cache_path.exists():
+        try:
+            with np.load(cache_path) as cached:
+                if np.array_equal(cached["_key"], key):
+                    return {name: cached[name] for name in TUBE_COLUMNS}
+        except Exception:
+            logger.warning(f"Invalid cache {cache_path}, rebuilding")
+    data = read_box_db(db_path)
+    if use_cache:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(cache_path, _key=key, **data)
+    return data
+
+
+def load_run_dir(run_dir="run", pattern="*.db", use_cache=True, workers=None) -> dict:
+    """Loads all box databases in parallel and concatenates their columns
+
+    Returns:
+        dict: column name -> array over all boxes, empty arrays if nothing found
+    """
+    db_paths = sorted(pathlib.Path(run_dir).glob(pattern))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(
+            executor.map(lambda p: load_box_db(p, use_cache=use_cache), db_paths)
+        )
+    logger.info(f"Loaded {len(db_paths)} box databases from {run_dir}")
+    if not results:
+        return empty_columns()
+    return {
+        name: np.concatenate([r[name] for r in results]) for name in TUBE_COLUMNS
+    }
+
+
+def empty_columns() -> dict:
+    data = {name: np.array([], dtype=str) for name in STR_COLUMNS}
+    data.update({name: np.array([], dtype=np.float64) for name in FLOAT_COLUMNS})
+    data["tube_id"] = np.array([], dtype=np.int64)
+    data["date"] = np.array([], dtype="datetime64[D]")
+    data["time"] = np.array([], dtype=np.int32)
+    return data
+
+
+def select(data, mask) -> dict:
+    return {name: values[mask] for name, values in data.items()}
+
+
+def export_archive(data, archive_dir) -> int:
+    """Saves columns as a directory of .npy arrays, rows sorted by time
+
+    date / time are merged into a datetime64[s] "timestamp", string columns
+    are dictionary encoded into "<name>_code" (int32) and "<name>_values".
+
+    Returns:
+        int: number of rows
+    """
+    archive_dir = pathlib.Path(archive_dir)
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    timestamp = data["date"].astype("datetime64[s]") + data["time"].astype(
+        "timedelta64[s]"
+    )
+    order = np.argsort(timestamp, kind="stable")
+    arrays = {"timestamp": timestamp[order], "tube_id": data["tube_id"][order]}
+    for name in FLOAT_COLUMNS:
+        arrays[name] = data[name][order]
+    for name in STR_COLUMNS:
+        values, codes = np.unique(data[name][order], return_inverse=True)
+        arrays[f"{name}_code"] = codes.astype(np.int32)
+        arrays[f"{name}_values"] = values
+    # meta is written last, an archive without it is incomplete
+    meta_path = archive_dir / "meta.json"
+    meta_path.unlink(missing_ok=True)
+    for name, values in arrays.items():
+        np.save(archive_dir / f"{name}.npy", values)
+    meta = {
+        "version": ARCHIVE_VERSION,
+        "rows": len(timestamp),
+        "columns": list(arrays.keys()),
+    }
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent=4)
+    return len(timestamp)
+
+
+def load_archive(archive_dir, decode=True) -> dict:
+    """Loads archive written by export_archive, arrays are memory-mapped
+
+    Args:
+        decode (bool): return the columns of load_run_dir (decoded strings,
+            date and time) plus "timestamp", otherwise the stored arrays are
+            returned as is, which is nearly free
+
+    Returns:
+        dict: column name -> array
+    """
+    archive_dir = pathlib.Path(archive_dir)
+    with open(archive_dir / "meta.json") as f:
+        meta = json.load(f)
+    if meta["version"] != ARCHIVE_VERSION:
+        logger.critical(f"Unsupported archive version {meta['version']}")
+        raise ValueError
+    data = {
+        name: np.load(archive_dir / f"{name}.npy", mmap_mode="r")
+        for name in meta["columns"]
+    }
+    if not decode:
+        return data
+    timestamp = data["timestamp"]
+    decoded = {"timestamp": timestamp, "tube_id": data["tube_id"]}
+    for name in FLOAT_COLUMNS:
+        decoded[name] = data[name]
+    for name in STR_COLUMNS:
+        decoded[name] = data[f"{name}_values"][data[f"{name}_code"]]
+    decoded["date"] = timestamp.astype("datetime64[D]")
+    decoded["time"] = (timestamp - decoded["date"]).astype(np.int32)
+    return decoded
@@ -0,0 +1,40 @@
+import argparse
+import logging
+import time
+
+import analysis
+
+# Parse arguments
+parser = argparse.ArgumentParser(
+    description="Compact all box databases into a columnar archive of .npy arrays"
+)
+parser.add_argument("-d", "--run-dir", default="run", help="directory of box databases")
+parser.add_argument(
+    "-o", "--output-dir", default="run/archive", help="archive directory"
+)
+parser.add_argument(
+    "--no-cache",
+    required=False,
+    help="always re-read databases instead of using the summary cache",
+    action="store_true",
+)
+parser.add_argument("-j", "--workers", type=int, default=None, help="parallel readers")
+args = parser.parse_args()
+# set logging format
+logging_format = "%(asctime)s,%(msecs)03d - %(levelname)s - %(message)s"
+logging.basicConfig(format=logging_format, datefmt="%Y-%m-%d:%H:%M:%S")
+logger = logging.getLogger("bend_tester")
+logger.setLevel(logging.INFO)
+
+# Export
+data = analysis.load_run_dir(
+    args.run_dir, use_cache=not args.no_cache, workers=args.workers
+)
+n_rows = analysis.export_archive(data, args.output_dir)
+logger.info(f"Archived {n_rows} tests to {args.output_dir}")
+
+# Check read back
+start_time = time.perf_counter()
+archived = analysis.load_archive(args.output_dir)
+load_time = time.perf_counter() - start_time
+logger.info(f"Archive loads {len(archived['box'])} tests in {load_time * 1000:.1f} ms")
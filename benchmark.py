@@ -0,0 +1,234 @@
+import argparse
+import json
+import logging
+import pathlib
+import platform
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import config
+import tube_data
+import utils
+
+RESOLUTIONS = {
+    "vga": (640, 480),
+    "hd": (1280, 720),
+    "fhd": (1920, 1080),
+    "4k": (3840, 2160),
+}
+
+# Parse arguments
+parser = argparse.ArgumentParser(
+    description="Benchmark detection, state machine and database hot paths on synthetic frames"
+)
+parser.add_argument(
+    "-r",
+    "--resolutions",
+    nargs="+",
+    default=["vga", "hd", "fhd", "4k"],
+    choices=list(RESOLUTIONS.keys()),
+    help="frame sizes for border detection",
+)
+parser.add_argument(
+    "-n", "--frames", type=int, default=50, help="frames per detection benchmark"
+)
+parser.add_argument(
+    "--noise", type=float, default=5, help="gaussian noise std in grey levels"
+)
+parser.add_argument(
+    "--blur", type=float, default=1.0, help="edge blur sigma in pixels (at VGA)"
+)
+parser.add_argument("--tilt", type=float, default=0.0, help="edge tilt in degrees")
+parser.add_argument(
+    "--updates", type=int, default=100000, help="Job_Cache.update calls"
+)
+parser.add_argument("--records", type=int, default=500, help="write_db / delete_db calls")
+parser.add_argument(
+    "-b",
+    "--baseline",
+    default=None,
+    help="baseline json to compare with",
+)
+parser.add_argument(
+    "--save",
+    default=None,
+    help="save results to json file, usable as baseline of later runs",
+)
+args = parser.parse_args()
+# set logging format
+logging_format = "%(asctime)s,%(msecs)03d - %(levelname)s - %(message)s"
+logging.basicConfig(format=logging_format, datefmt="%Y-%m-%d:%H:%M:%S")
+logger = logging.getLogger("bend_tester")
+logger.setLevel(logging.WARNING)
+
+
+def render_frame(x, size, noise=5, blur=1.0, tilt=0.0, seed=0):
+    """Renders dark background with bright tube from column x to the right
+
+    x is the sub-pixel edge location at the middle row, tilt rotates the edge
+    around it, blur is given at VGA and scaled with the frame width.
+
+    Returns:
+        np.ndarray: BGR uint8 frame
+    """
+    w, h = size
+    rows = np.arange(h, dtype=np.float32)[:, None]
+    cols = np.arange(w, dtype=np.float32)[None, :]
+    edge = x + (rows - (h - 1) / 2) * np.tan(np.radians(tilt))
+    # anti-aliased coverage of each pixel by the tube
+    coverage = np.clip(cols - edge + 0.5, 0, 1)
+    img = 40 + 140 * coverage
+    sigma = blur * w / 640
+    if sigma > 0:
+        img = cv2.GaussianBlur(img, (0, 0), sigma)
+    rng = np.random.default_rng(seed)
+    img = img + rng.normal(0, noise, img.shape)
+    img = np.clip(img, 0, 255).astype(np.uint8)
+    return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+
+
+def bench_detect(cfg, size) -> dict:
+    """Times Border_Detector (get_border pipeline) on edges at known x"""
+    w, _ = size
+    rng = np.random.default_rng(0)
+    xs_true = rng.uniform(0.3 * w, 0.7 * w, args.frames)
+    frames = [
+        render_frame(x, size, args.noise, args.blur, args.tilt, seed=i)
+        for i, x in enumerate(xs_true)
+    ]
+    detector = utils.Border_Detector(cfg, n_outputs=1)
+    detector.detect(frames[0])
+    xs = np.full(len(frames), np.nan)
+    start_time = time.perf_counter()
+    for i, img in enumerate(frames):
+        _, x = detector.detect(img)
+        if x is not None:
+            xs[i] = x
+    elapsed = time.perf_counter() - start_time
+    found = ~np.isnan(xs)
+    err = np.abs(xs[found] - xs_true[found])
+    return {
+        "ms_per_frame": elapsed / len(frames) * 1000,
+        "fps": len(frames) / elapsed,
+        "miss_rate": float(1 - found.mean()),
+        "mean_err_px": float(err.mean()) if err.size else float("nan"),
+        "max_err_px": float(err.max()) if err.size else float("nan"),
+    }
+
+
+def bench_limit_img(cfg) -> dict:
+    """Times Tube_Cache.get_limit_img, limits change every 10th frame"""
+    size = RESOLUTIONS["hd"]
+    base = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+    tube_cache = tube_data.Tube_Cache(base, cfg)
+    n = args.frames * 10
+    start_time = time.perf_counter()
+    for i in range(n):
+        if i % 10 == 0:
+            tube_cache.update_x(500 + i // 10 % 40)
+        tube_cache.get_limit_img()
+    elapsed = time.perf_counter() - start_time
+    return {"us_per_call": elapsed / n * 1e6, "calls_per_s": n / elapsed}
+
+
+def bench_job_cache(cfg) -> dict:
+    """Times Job_Cache.update over a long sequence of tubes at 30 fps"""
+    base = np.zeros((720, 1280, 3), dtype=np.uint8)
+    tube_cache = tube_data.Tube_Cache(base, cfg)
+    tube_cache.update_x(600)
+    job_cache = utils.Job_Cache(cfg)
+    # 10 s with tube, 5 s without
+    period = 450
+    edges = [600.0 if i % period < 300 else None for i in range(args.updates)]
+    start_time = time.perf_counter()
+    for i, edge in enumerate(edges):
+        job_cache.update(edge, tube_cache, now=i / 30)
+    elapsed = time.perf_counter() - start_time
+    n_records = sum(1 for _, _, new, _ in job_cache.transitions if new == 5)
+    return {
+        "us_per_call": elapsed / args.updates * 1e6,
+        "calls_per_s": args.updates / elapsed,
+        "records": n_records,
+    }
+
+
+def bench_db(cfg, async_write) -> dict:
+    """Times Tube_Cache.write_db / delete_db against a temporary directory"""
+    base = np.zeros((720, 1280, 3), dtype=np.uint8)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tube_cache = tube_data.Tube_Cache(base, cfg)
+        tube_cache.connect_db(temp_dir, "bench", async_write=async_write)
+        tube_cache.update_x(600)
+        tube_cache.update_x(640)
+        tube_cache.update_status()
+        start_time = time.perf_counter()
+        for _ in range(args.records):
+            tube_cache.write_db()
+        write_time = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        for _ in range(args.records):
+            tube_cache.delete_db()
+        delete_time = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        tube_cache.disconnect_db()
+        close_time = time.perf_counter() - start_time
+    return {
+        "write_us": write_time / args.records * 1e6,
+        "delete_us": delete_time / args.records * 1e6,
+        "close_ms": close_time * 1000,
+    }
+
+
+# Load configs
+main = config.load_yaml_dict(yaml_path="share/main/main.yaml")
+cfg = config.Config(main)
+cfg.update({"job": {"box_id": "bench", "operator": ["bench"]}})
+cfg.main.roi.enable = False
+
+# Run
+results = {}
+for name in args.resolutions:
+    results[f"detect_{name}"] = bench_detect(cfg, RESOLUTIONS[name])
+results["limit_img"] = bench_limit_img(cfg)
+results["job_cache"] = bench_job_cache(cfg)
+results["db_sync"] = bench_db(cfg, async_write=False)
+results["db_async"] = bench_db(cfg, async_write=True)
+
+# Report
+baseline = None
+if args.baseline:
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+print("")
+print(f"{'benchmark':<16}{'metric':<16}{'value':>12}{'baseline':>12}{'ratio':>8}")
+for bench, metrics in results.items():
+    for metric, value in metrics.items():
+        line = f"{bench:<16}{metric:<16}{value:>12.3f}"
+        if baseline and metric in baseline.get(bench, {}):
+            ref = baseline[bench][metric]
+            ratio = value / ref if ref else float("nan")
+            line += f"{ref:>12.3f}{ratio:>8.2f}"
+        print(line)
+if baseline:
+    print("(ratio > 1: higher than baseline, slower for times, faster for rates)")
+if args.save:
+    pathlib.Path(args.save).parent.mkdir(parents=True, exist_ok=True)
+    output = {
+        "settings": {
+            key: value for key, value in vars(args).items() if key not in ("baseline", "save")
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "results": results,
+    }
+    with open(args.save, "w") as f:
+        json.dump(output, f, indent=4)
+    print(f"Results saved to {args.save}")
@@ -0,0 +1,93 @@
+import argparse
+import logging
+import time
+
+import cv2
+import numpy as np
+
+import config
+import utils
+
+# Parse arguments
+parser = argparse.ArgumentParser(
+    description="Compare speed and detected x of border detector engines on the same frames"
+)
+parser.add_argument("yaml_config", action="store")
+parser.add_argument(
+    "-n",
+    "--max-frames",
+    type=int,
+    default=300,
+    help="max number of frames to read from the video",
+)
+parser.add_argument(
+    "-e",
+    "--engines",
+    nargs="+",
+    default=["hough", "projection"],
+    help="detector engines to compare, the first one is the reference",
+)
+args = parser.parse_args()
+# set logging format
+logging_format = "%(asctime)s,%(msecs)03d - %(levelname)s - %(message)s"
+logging.basicConfig(format=logging_format, datefmt="%Y-%m-%d:%H:%M:%S")
+logger = logging.getLogger("bend_tester")
+logger.setLevel(logging.INFO)
+
+# Load configs
+main = config.load_yaml_dict(yaml_path="share/main/main.yaml")
+cfg = config.Config(main)
+job = config.load_yaml_dict(yaml_path=args.yaml_config)
+cfg.update(job)
+cj = cfg.job
+
+# Read frames
+frames = []
+if cj.use_img:
+    img = cv2.imread(cj.img_path)
+    if img is not None:
+        frames.append(cv2.resize(img, cj.dsize, None, cj.fx, cj.fy))
+else:
+    cap = cv2.VideoCapture(cj.video_path)
+    while len(frames) < args.max_frames:
+        success, img = cap.read()
+        if not success:
+            break
+        frames.append(cv2.resize(img, cj.dsize, None, cj.fx, cj.fy))
+    cap.release()
+if not frames:
+    logger.critical("no video captured")
+    exit()
+logger.info(f"Loaded {len(frames)} frames of size {frames[0].shape}")
+
+# Run detectors
+results = {}
+for engine in args.engines:
+    engine_cfg = cfg.clone()
+    engine_cfg.main.detector = engine
+    detector = utils.Border_Detector(engine_cfg)
+    detector.allocate(frames[0].shape)
+    xs = np.full(len(frames), np.nan)
+    start_time = time.perf_counter()
+    for i, img in enumerate(frames):
+        _, x = detector.detect(img)
+        if x is not None:
+            xs[i] = x
+    results[engine] = (xs, time.perf_counter() - start_time)
+
+# Report
+ref = args.engines[0]
+ref_xs, ref_time = results[ref]
+print("")
+print(f"{'engine':<12}{'ms/frame':>10}{'speedup':>10}{'found':>8}{'mean|dx|':>10}{'max|dx|':>10}{'mismatch':>10}")
+for engine, (xs, t) in results.items():
+    both = ~np.isnan(xs) & ~np.isnan(ref_xs)
+    mismatch = int(np.sum(np.isnan(xs) != np.isnan(ref_xs)))
+    dx = np.abs(xs[both] - ref_xs[both])
+    mean_dx = f"{dx.mean():.2f}" if dx.size else "-"
+    max_dx = f"{dx.max():.2f}" if dx.size else "-"
+    found = int(np.sum(~np.isnan(xs)))
+    print(
+        f"{engine:<12}{t / len(frames) * 1000:>10.2f}{ref_time / t:>10.2f}{found:>8}{mean_dx:>10}{max_dx:>10}{mismatch:>10}"
+    )
+print(f"(dx and mismatch are relative to {ref})")
@@ -11,6 +11,16 @@ DEFAULT_CFG = {
         "aml": 20,
         "threshold": 1.8,  # mm
         "interval": 50,  # ms
+        "display": {"fps": 20, "on_change": False, "idle_period": 1.0,},
+        "sound": {"enable": True},
+        "server": {
+            "enable": False,
+            "host": "127.0.0.1",
+            "port": 8080,
+            "fps": 10,
+            "jpeg_quality": 80,
+            "event_queue": 100,
+        },
         "scale_abs": {"alpha": 2, "beta": 50,},
         "gauss_blur": {"ksize": [5, 5], "sigmaX": 1.5,},
         "canny": {"threshold1": 100, "threshold2": 50,},
@@ -23,10 +33,54 @@ DEFAULT_CFG = {
             "minLineLength": 40,
             "maxLineGap": 10,
         },
+        "grayscale": True,
+        "detector": "hough",
+        "projection": {"min_fraction": 0.3, "window": 5,},
         "style": {"line_color": [255, 255, 0]},
+        "edge_filter": {
+            "method": "none",
+            "window": 5,
+            "alpha": 0.5,
+            "process_noise": 1.0,
+            "measurement_noise": 4.0,
+            "spread_tol": 5,
+            "max_missing": 3,
+        },
+        "confidence_threshold": None,
+        "fast_test_delay": 0.5,
+        "fast_record_delay": 0.5,
+        "profile": {
+            "enable": False,
+            "overlay": True,
+            "window": 300,
+            "export": "csv",
+            "export_interval": 30,
+        },
+        "roi": {"enable": False, "half_width": 80, "min_lines": 1,},
+        "trace": {"enable": False, "max_samples": 2048, "percentile": None,},
+        "idle": {"enable": False, "interval": 3, "scale": 0.5,},
+        "frame_gate": {
+            "enable": False,
+            "size": [32, 18],
+            "threshold": 2.0,
+            "max_skip": 30,
+        },
+        "database": {"async_write": True},
+        "evidence": {
+            "enable": False,
+            "seconds": 10,
+            "fps": 5,
+            "scale": 1.0,
+            "codec": "mp4v",
+            "dir": "clips",
+            "pending": 2,
+        },
+        "pipeline": {"queue_size": 2, "drop_policy": "oldest", "report_interval": 10,},
     },
     "job": {
         "output_dir": "./run",
+        "display_scale": None,
+        "process_scale": None,
         "box_id": "XXXXXX",
         "operator": []
     },
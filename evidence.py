@@ -0,0 +1,128 @@
+import logging
+import pathlib
+import queue
+import threading
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger("bend_tester")
+
+
+class Frame_Ring(object):
+    """Fixed-size ring buffer of the last seconds of frames
+
+    Frames are copied into one array preallocated with the first frame. A dump
+    swaps it with one of `pending` spare arrays of the same size and queues it
+    on the clip writer thread, so saving a clip neither copies frames nor
+    waits for a running write, and memory use does not grow with session
+    length. The next clip starts with the frames pushed after the dump.
+    """
+
+    def __init__(self, cfg) -> None:
+        super().__init__()
+        ce = cfg.main.evidence
+        self.fps = ce.fps or 5
+        self.capacity = max(1, int(round((ce.seconds or 10) * self.fps)))
+        self.scale = ce.scale or 1.0
+        self.codec = ce.codec or "mp4v"
+        self.clip_dir = pathlib.Path(cfg.job.output_dir) / (ce.dir or "clips")
+        self.n_pending = max(1, ce.pending or 2)
+        self.frames = None
+        self.spares = queue.Queue()
+        self.requests = queue.Queue()
+        self.count = 0
+        self.t_last = 0
+        self._writer = None
+
+    def allocate(self, shape) -> None:
+        logger.info(
+            f"Allocating evidence buffer of {self.capacity} frames, {shape}, "
+            f"{(1 + self.n_pending) * self.capacity * np.prod(shape) / 1e6:.0f} MB"
+        )
+        self.frames = np.empty((self.capacity,) + shape, dtype=np.uint8)
+        # buffers of the old shape still being written are dropped when done
+        self.spares = queue.Queue()
+        for _ in range(self.n_pending):
+            self.spares.put(np.empty_like(self.frames))
+        self.count = 0
+
+    def push(self, img) -> None:
+        """Adds frame, decimated to the buffer frame rate"""
+        now = time.perf_counter()
+        if now - self.t_last < 1 / self.fps:
+            return
+        self.t_last = now
+        if self.scale != 1:
+            img = cv2.resize(img, None, None, self.scale, self.scale, cv2.INTER_AREA)
+        if self.frames is None or self.frames.shape[1:] != img.shape:
+            self.allocate(img.shape)
+        np.copyto(self.frames[self.count % self.capacity], img)
+        self.count += 1
+
+    def dump(self, name):
+        """Queues buffered frames to be written to a compressed clip
+
+        Returns:
+            str: clip path, None if nothing is buffered or all spare buffers
+                are still queued for writing
+        """
+        if self.frames is None or not self.count:
+            return None
+        try:
+            spare = self.spares.get_nowait()
+        except queue.Empty:
+            logger.warning(
+                f"{self.n_pending} evidence clips still being written, skipped"
+            )
+            return None
+        frames, count = self.frames, self.count
+        self.frames, self.count = spare, 0
+        self.clip_dir.mkdir(parents=True, exist_ok=True)
+        time_string = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
+        clip_path = self.clip_dir / f"{name}_{time_string}.mp4"
+        if self._writer is None:
+            self._writer = threading.Thread(
+                target=self.run_writer, name="clip_writer", daemon=True
+            )
+            self._writer.start()
+        self.requests.put((clip_path, frames, count))
+        return str(clip_path)
+
+    def run_writer(self) -> None:
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            clip_path, frames, count = request
+            try:
+                self.write_clip(clip_path, frames, count)
+            except Exception:
+                logger.exception(f"Failed to write clip {clip_path}")
+            if self.frames is not None and frames.shape == self.frames.shape:
+                self.spares.put(frames)
+
+    def write_clip(self, clip_path, frames, count) -> None:
+        """Writes the count frames pushed into ring array frames, oldest first"""
+        h, w = frames.shape[1:3]
+        writer = cv2.VideoWriter(
+            str(clip_path), cv2.VideoWriter_fourcc(*self.codec), self.fps, (w, h)
+        )
+        if not writer.isOpened():
+            logger.error(f"Can't open clip writer for {clip_path}")
+            return
+        n = min(count, self.capacity)
+        start = count % self.capacity if count > self.capacity else 0
+        for i in range(n):
+            writer.write(frames[(start + i) % self.capacity])
+        writer.release()
+        logger.info(f"Evidence clip saved: {clip_path}")
+
+    def close(self) -> None:
+        """Waits until all queued clips are written"""
+        if self._writer is not None:
+            self.requests.put(None)
+            self._writer.join()
+            self._writer = None
@@ -1,13 +1,18 @@
 import argparse
+import concurrent.futures
 import logging
+import os
 import time
 
 import cv2
 
 import config
-import tube_data
+import monitor_server
+import pipeline
+import station
 import utils
 
+launch_time = time.perf_counter()
 # Parse arguments
 parser = argparse.ArgumentParser()
 parser.add_argument("yaml_config", action="store")
@@ -25,6 +30,38 @@ parser.add_argument(
     help="run in auto mode",
     action="store_true",
 )
+parser.add_argument(
+    "-p",
+    "--pipeline",
+    required=False,
+    help="run capture, processing and display in a threaded pipeline",
+    action="store_true",
+)
+parser.add_argument(
+    "--headless",
+    required=False,
+    help="run auto mode without window, sound feedback only (Ctrl+C to exit)",
+    action="store_true",
+)
+parser.add_argument(
+    "--serve",
+    required=False,
+    help="serve monitor stream and events on localhost (see server in main.yaml)",
+    action="store_true",
+)
+parser.add_argument(
+    "-n",
+    "--max-frames",
+    type=int,
+    default=0,
+    help="exit after this number of frames, 0 for no limit",
+)
+parser.add_argument(
+    "--profile",
+    required=False,
+    help="record per-stage latencies (see profile section in main.yaml)",
+    action="store_true",
+)
 args = parser.parse_args()
 if not args.yaml_config:
     parser.print_help()
@@ -40,105 +77,197 @@ if args.debug:
     logger.setLevel(logging.DEBUG)
 
 
-# Load configs
+# Load configs, camera is opened in the background meanwhile
 logger.info("#" * 80)
 logger.info(f"Executing: {args.yaml_config}")
+job = config.load_yaml_dict(yaml_path=args.yaml_config)
+job_cfg = config.Config({})
+job_cfg.update(job)
+startup_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+cap_future = startup_executor.submit(utils.open_capture, job_cfg.job)
 main = config.load_yaml_dict(yaml_path="share/main/main.yaml")
 cfg = config.Config(main)
-job = config.load_yaml_dict(yaml_path=args.yaml_config)
 cfg.update(job)
+if args.profile:
+    cfg.main.profile.enable = True
+if args.serve:
+    cfg.main.server.enable = True
+if args.headless and not args.auto:
+    logger.info("Headless mode runs in auto mode")
+    args.auto = True
 
 # Main loop
 start_time = time.perf_counter()
 cj = cfg.job
-tube_cache = None
-test_sound = utils.Test_Sound()
-if cj.webcam:
-    cap = cv2.VideoCapture(cj.webcam_id)
-else:
-    cap = cv2.VideoCapture(cj.video_path)
-job_cache = utils.Job_Cache(cfg)
-while True:
-    # Read image & checks
+test_sound = utils.Test_Sound(enable=cfg.main.sound.enable)
+monitor = None
+if cfg.main.server.enable:
+    monitor = monitor_server.Monitor_Server(cfg)
+    monitor.start()
+tester = station.Station(
+    cfg,
+    auto=args.auto,
+    debug=args.debug,
+    on_event=monitor.publish_event if monitor else None,
+)
+timer = tester.timer
+cap = cap_future.result()
+startup_executor.shutdown()
+frame_count = 0
+# decoded image of use_img mode, only re-read when the file changes
+image_cache = {"key": None, "img": None}
+limiter = utils.Display_Limiter(cfg)
+# camera sets the pace of live capture, recorded videos are played at interval
+wait_ms = 1 if cj.webcam else cfg.main.interval
+
+
+def read_frame():
+    """Reads next captured frame from configured source, returns None if failed
+
+    Scaling for display / detection is done by Station.prepare()
+    """
     if cj.use_video:
         success, img = cap.read()
     elif cj.use_img:
-        img = cv2.imread(cj.img_path)
-    else:
-        break
-    if img is not None:
-        img = cv2.resize(img, cj.dsize, None, cj.fx, cj.fy)
+        img = read_image(cj.img_path)
     else:
-        logger.critical("no video captured")
-        break
-    if tube_cache is None:
-        tube_cache = tube_data.Tube_Cache(img, cfg)
-        tube_cache.connect_db(box=cj.box_id, dir=cfg.job.output_dir)
-
-    # Update border location
-    border_img, x = utils.get_border(img, cfg, debug=args.debug)
-    display_img = cv2.addWeighted(img, 0.8, border_img, 1, 0)
-
-    # Process new data
-    job_cache.update(x, tube_cache)
-    if args.auto:
-        state = job_cache.get_state()
-        state_name = job_cache.get_state_name()
-        logger.debug(f"Current state: {state_name} ({state})")
-        if state == 3:
-            tube_cache.update_x(x)
-        elif state == 5:
-            if status == "PASS":
-                test_sound.add()
-            else:
-                test_sound.error()
-            logger.info(f"New test: status = {status}, dy = {dy * 1000:05f} um")
-            tube_cache.write_db()
-        elif state == 6:
-            tube_cache.reset_x()
+        return None
+    return img
+
+
+def read_image(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (stat.st_mtime_ns, stat.st_size)
+    if key != image_cache["key"]:
+        image_cache["img"] = cv2.imread(path)
+        image_cache["key"] = key
+    return image_cache["img"]
+
+
+def count_frame():
+    """Counts processed frames, returns False if max frames is reached
+
+    Also lets the timer export its periodic summary, repainted or not.
+    """
+    global frame_count
+    frame_count += 1
+    if timer:
+        timer.update()
+    if frame_count == 1:
+        logger.info(f"Time to first frame: {time.perf_counter() - launch_time:.3f} s")
+    return not args.max_frames or frame_count < args.max_frames
+
+
+def play_sound(status):
+    if status == "PASS":
+        test_sound.add()
     else:
-        tube_cache.update_x(x)
-    status, dy = tube_cache.get_tube_data()
-
-    # React to keyboard inputs
-    ky = cv2.waitKey(cfg.main.interval)
-    if ky == ord("\r"):
-        if status == "PASS":
-            test_sound.add()
-        else:
-            test_sound.error()
-        logger.info(f"New test: status = {status}, dy = {dy * 1000:05f} um")
-        tube_cache.write_db()
-        tube_cache.reset_x()
-        job_cache.set_state(6)
-    elif ky == ord("d"):
-        test_sound.remove()
-        logger.info(f"Deleting last entry")
-        tube_cache.delete_db()
-        job_cache.set_state(1)
-    elif ky == ord("r"):
-        logger.info("Resetting tube data")
-        tube_cache.reset_x()
-        job_cache.set_state(6)
-    elif ky == ord("q"):
-        logger.info("Exiting program ...")
-        job_cache.set_state(0)
-        break
-
-    # Display
-    limit_img = tube_cache.get_limit_img()
-    display_img = cv2.addWeighted(display_img, 1, limit_img, 1, 0)
-    if args.auto:
-        h = tube_cache.r_range
-        display_img = cv2.putText(
-            display_img,
-            f"STATE: {job_cache.get_state_name()}",
-            (10, h - 20),
-            cv2.FONT_HERSHEY_COMPLEX_SMALL,
-            1,
-            (0, 255, 255),
-        )
+        test_sound.error()
+
+
+def display(img, border_img, x):
+    """Repaints monitor if due (not in headless mode) and feeds monitor server"""
+    serve = monitor is not None and monitor.wants_frame()
+    show = not args.headless and limiter.is_due(tester.get_overlay_key(x))
+    if not (serve or show):
+        return
+    display_img = tester.render(img, border_img)
+    if timer:
+        display_img = timer.draw_overlay(display_img)
+    if serve:
+        monitor.publish_frame(display_img)
+    if not show:
+        return
+    if timer:
+        t = time.perf_counter()
     cv2.imshow("Monitor", display_img)
+    if timer:
+        timer.lap("imshow", t)
+
+
+def react(ky):
+    """Reacts to keyboard inputs, returns False if exit is requested"""
+    if tester.tube_cache is None:
+        return ky != ord("q")
+    status, _ = tester.tube_cache.get_tube_data()
+    action = tester.handle_key(ky)
+    if action == "record":
+        play_sound(status)
+    elif action == "delete":
+        test_sound.remove()
+    return action != "quit"
+
+
+def run_pipeline():
+    logger.info("Running in pipeline mode")
+    frame_pipeline = pipeline.Pipeline(read_frame, tester, cfg)
+    frame_pipeline.start()
+    try:
+        while frame_pipeline.is_running():
+            frame = frame_pipeline.get_frame()
+            for record in frame_pipeline.get_records():
+                play_sound(record[0])
+            if frame is not None:
+                with frame_pipeline.lock:
+                    display(frame.img, frame.border_img, frame.x)
+                if not count_frame():
+                    break
+            if args.headless:
+                continue
+            # React to keyboard inputs
+            ky = cv2.waitKey(1)
+            with frame_pipeline.lock:
+                if not react(ky):
+                    break
+    finally:
+        frame_pipeline.stop()
+
+
+def run_sequential():
+    while True:
+        # Read image & checks
+        if timer:
+            t = time.perf_counter()
+        frame = read_frame()
+        if timer:
+            timer.lap("read", t)
+        if frame is None:
+            logger.critical("no video captured")
+            break
+
+        # Update border location & process new data
+        img, border_img, x, record = tester.process(frame)
+        if record:
+            play_sound(record[0])
+        if args.headless:
+            display(img, border_img, x)
+            if not count_frame():
+                break
+            if not cj.webcam:
+                time.sleep(wait_ms / 1000)
+            continue
+
+        # React to keyboard inputs
+        ky = cv2.waitKey(wait_ms)
+        if not react(ky):
+            break
+
+        # Display
+        display(img, border_img, x)
+        if not count_frame():
+            break
+
+
+try:
+    if args.pipeline:
+        run_pipeline()
+    else:
+        run_sequential()
+except KeyboardInterrupt:
+    logger.info("Interrupted, exiting program ...")
 
 end_time = time.perf_counter()
 time_consumed = end_time - start_time
@@ -147,10 +276,14 @@ logger.info(f"Time consumed: {time_consumed_str}")
 logger.info("#" * 80)
 
 # Release and Disconnect
+if not args.headless:
+    logger.info(f"Monitor: {limiter.painted} repaints, {limiter.skipped} frames skipped")
+    cv2.destroyAllWindows()
 cap.release()
-cv2.destroyAllWindows()
-if tube_cache:
-    tube_cache.disconnect_db()
+tester.close()
+test_sound.close()
+if monitor:
+    monitor.stop()
 
 logger.info("Done!")
-logger.info("#" * 80)
\ No newline at end of file
+logger.info("#" * 80)
@@ -0,0 +1,228 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+
+import cv2
+
+logger = logging.getLogger("bend_tester")
+
+INDEX_HTML = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>Bend Tester Monitor</title></head>
+<body style="font-family: monospace">
+<img src="/stream.mjpg" style="max-width: 100%">
+<pre id="events"></pre>
+<script>
+const log = document.getElementById("events");
+const source = new EventSource("/events");
+source.onmessage = (e) => {
+    log.textContent = e.data + "\\n" + log.textContent.split("\\n").slice(0, 50).join("\\n");
+};
+</script>
+</body>
+</html>
+"""
+
+
+class Monitor_Server(object):
+    """Local HTTP server of the monitor image (MJPEG) and events (SSE)
+
+    Runs an asyncio loop on its own thread. The capture loop only hands over
+    references of the latest monitor image and events, JPEG encoding runs on
+    the loop's executor, at most at server fps and only while clients watch.
+    Each client is sent the newest frame when it is ready for one, so slow
+    clients skip frames, and its event queue drops the oldest events when
+    full, measurement is never blocked by clients.
+
+    Routes:
+        /: page with stream and event log
+        /stream.mjpg: multipart MJPEG stream
+        /events: server-sent events, one json object per state change / record
+    """
+
+    def __init__(self, cfg) -> None:
+        super().__init__()
+        cs = cfg.main.server
+        self.host = cs.host or "127.0.0.1"
+        self.port = cs.port or 8080
+        self.min_period = 1 / cs.fps if cs.fps else 0
+        self.jpeg_quality = cs.jpeg_quality or 80
+        self.event_queue_size = cs.event_queue or 100
+        self.loop = None
+        self.thread = None
+        self.server = None
+        self.ready = threading.Event()
+        # latest monitor image, replaced by capture loop
+        self.lock = threading.Lock()
+        self.frame = None
+        self.frame_id = 0
+        self.t_frame = 0
+        # latest encoded JPEG, only touched by the loop
+        self.jpeg = None
+        self.jpeg_id = 0
+        self.jpeg_changed = None
+        self.event_clients = set()
+        self.n_stream_clients = 0
+        self.events_dropped = 0
+
+    def start(self) -> None:
+        self.thread = threading.Thread(
+            target=self.run, name="monitor_server", daemon=True
+        )
+        self.thread.start()
+        self.ready.wait(timeout=5)
+
+    def run(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.jpeg_changed = asyncio.Condition()
+        try:
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self.handle, self.host, self.port)
+            )
+        except OSError as e:
+            logger.error(f"Can't start monitor server on {self.host}:{self.port}: {e}")
+            self.ready.set()
+            return
+        logger.info(f"Monitor server running on http://{self.host}:{self.port}/")
+        self.ready.set()
+        self.loop.run_until_complete(self.encode_loop())
+        # close connections of remaining clients
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
+
+    def is_running(self) -> bool:
+        return self.server is not None and self.server.is_serving()
+
+    def wants_frame(self) -> bool:
+        """Checks whether a new monitor image is needed, to skip rendering"""
+        return (
+            self.n_stream_clients > 0
+            and time.perf_counter() - self.t_frame >= self.min_period
+        )
+
+    def publish_frame(self, img) -> None:
+        """Hands over monitor image, img must not be modified afterwards"""
+        with self.lock:
+            self.frame = img
+            self.frame_id += 1
+            self.t_frame = time.perf_counter()
+
+    def publish_event(self, event) -> None:
+        """Sends event dict to all event clients, safe to call from any thread"""
+        if self.is_running():
+            self.loop.call_soon_threadsafe(self.dispatch_event, json.dumps(event))
+
+    def dispatch_event(self, message) -> None:
+        for client_queue in self.event_clients:
+            if client_queue.full():
+                client_queue.get_nowait()
+                self.events_dropped += 1
+            client_queue.put_nowait(message)
+
+    def encode(self, img) -> bytes:
+        success, buf = cv2.imencode(
+            ".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+        )
+        return buf.tobytes() if success else None
+
+    async def encode_loop(self) -> None:
+        """Encodes latest monitor image when it changes"""
+        encoded_id = 0
+        while self.server.is_serving():
+            with self.lock:
+                frame, frame_id = self.frame, self.frame_id
+            if frame is None or frame_id == encoded_id:
+                await asyncio.sleep(0.01)
+                continue
+            jpeg = await self.loop.run_in_executor(None, self.encode, frame)
+            encoded_id = frame_id
+            if jpeg is None:
+                continue
+            async with self.jpeg_changed:
+                self.jpeg = jpeg
+                self.jpeg_id += 1
+                self.jpeg_changed.notify_all()
+
+    async def handle(self, reader, writer) -> None:
+        try:
+            request = await reader.readline()
+            # skip headers
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.decode("latin-1").split()
+            path = parts[1] if len(parts) > 1 else "/"
+            if path == "/":
+                await self.send_index(writer)
+            elif path == "/stream.mjpg":
+                await self.send_stream(writer)
+            elif path == "/events":
+                await self.send_events(writer)
+            else:
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def send_index(self, writer) -> None:
+        body = INDEX_HTML.encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\n"
+            + f"Content-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+
+    async def send_stream(self, writer) -> None:
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nCache-Control: no-cache\r\n"
+            b"Content-Type: multipart/x-mixed-replace; boundary=frame\r\n\r\n"
+        )
+        self.n_stream_clients += 1
+        sent_id = 0
+        try:
+            while True:
+                async with self.jpeg_changed:
+                    await self.jpeg_changed.wait_for(lambda: self.jpeg_id != sent_id)
+                    jpeg, sent_id = self.jpeg, self.jpeg_id
+                writer.write(
+                    b"--frame\r\nContent-Type: image/jpeg\r\n"
+                    + f"Content-Length: {len(jpeg)}\r\n\r\n".encode()
+                    + jpeg
+                    + b"\r\n"
+                )
+                # a slow client waits here and gets the newest frame afterwards
+                await writer.drain()
+        finally:
+            self.n_stream_clients -= 1
+
+    async def send_events(self, writer) -> None:
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nCache-Control: no-cache\r\n"
+            b"Content-Type: text/event-stream\r\n\r\n"
+        )
+        await writer.drain()
+        client_queue = asyncio.Queue(maxsize=self.event_queue_size)
+        self.event_clients.add(client_queue)
+        try:
+            while True:
+                message = await client_queue.get()
+                writer.write(f"data: {message}\n\n".encode())
+                await writer.drain()
+        finally:
+            self.event_clients.discard(client_queue)
+
+    def stop(self) -> None:
+        if not self.is_running():
+            return
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.thread.join(timeout=1)
+        if self.events_dropped:
+            logger.info(f"Monitor server: {self.events_dropped} events dropped")
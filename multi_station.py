@@ -0,0 +1,231 @@
+import argparse
+import functools
+import logging
+import math
+import multiprocessing
+import queue
+import time
+
+import cv2
+import numpy as np
+
+import config
+import station
+import tube_data
+import utils
+
+logging_format = "%(asctime)s,%(msecs)03d - %(processName)s - %(levelname)s - %(message)s"
+logger = logging.getLogger("bend_tester")
+
+
+def load_station_jobs(stations_cfg) -> list:
+    """Builds job section dict of each station
+
+    Each station entry may name a base job yaml with "job", other keys
+    overwrite the job section of the base config.
+    """
+    jobs = []
+    for entry in stations_cfg["stations"]:
+        entry = dict(entry)
+        job = config.Config({})
+        if "job" in entry:
+            job.update(config.load_yaml_dict(yaml_path=entry.pop("job")))
+        job.job.update(entry)
+        jobs.append(job.job.get_config_dict())
+    return jobs
+
+
+def run_station(
+    index,
+    main_dict,
+    job_dict,
+    auto,
+    tile_size,
+    frame_queue,
+    event_queue,
+    command_queue,
+    db_queue,
+    reply_queue,
+    stop_event,
+):
+    """Capture + detection + state machine of one station, run in its own process"""
+    logging.basicConfig(format=logging_format, datefmt="%Y-%m-%d:%H:%M:%S")
+    logger.setLevel(logging.INFO)
+    # monitor frames may be lost on exit, do not wait for them to be consumed
+    frame_queue.cancel_join_thread()
+    cfg = config.Config({"main": main_dict, "job": job_dict})
+    cj = cfg.job
+    writer_factory = functools.partial(
+        tube_data.Remote_Db_Writer,
+        request_queue=db_queue,
+        reply_queue=reply_queue,
+        client_id=index,
+    )
+    tester = station.Station(cfg, auto=auto, writer_factory=writer_factory)
+    cap = utils.open_capture(cj)
+    dropped = 0
+    try:
+        while not stop_event.is_set():
+            success, frame = cap.read()
+            if not success:
+                logger.critical(f"Station {index + 1}: no video captured")
+                break
+            img, border_img, x, record = tester.process(frame)
+            if record:
+                event_queue.put((index, "record", record[0]))
+            # keyboard commands forwarded by the launcher
+            while True:
+                try:
+                    ky = command_queue.get_nowait()
+                except queue.Empty:
+                    break
+                status, _ = tester.tube_cache.get_tube_data()
+                action = tester.handle_key(ky)
+                if action:
+                    event_queue.put((index, action, status))
+            tile = cv2.resize(
+                tester.render(img, border_img), tile_size, interpolation=cv2.INTER_AREA
+            )
+            try:
+                frame_queue.put_nowait(tile)
+            except queue.Full:
+                dropped += 1
+            if not cj.webcam:
+                # play recorded video at its original pace
+                time.sleep(cfg.main.interval / 1000)
+    finally:
+        cap.release()
+        tester.close()
+        logger.info(f"Station {index + 1} stopped, {dropped} monitor frames dropped")
+
+
+def main():
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description="Run several stations in parallel processes with one tiled monitor"
+    )
+    parser.add_argument("yaml_config", action="store", help="multi-station config")
+    parser.add_argument(
+        "-a",
+        "--auto",
+        required=False,
+        help="run in auto mode",
+        action="store_true",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(format=logging_format, datefmt="%Y-%m-%d:%H:%M:%S")
+    logger.setLevel(logging.INFO)
+
+    # Load configs
+    logger.info("#" * 80)
+    logger.info(f"Executing: {args.yaml_config}")
+    main_dict = config.load_yaml_dict(yaml_path="share/main/main.yaml")
+    cfg = config.Config(main_dict)
+    stations_cfg = config.load_yaml_dict(yaml_path=args.yaml_config)
+    jobs = load_station_jobs(stations_cfg)
+    tile_w, tile_h = stations_cfg.get("tile_size", [640, 360])
+    n_stations = len(jobs)
+    n_cols = math.ceil(math.sqrt(n_stations))
+    n_rows = math.ceil(n_stations / n_cols)
+    for i, job in enumerate(jobs):
+        logger.info(f"Station {i + 1}: box {job['box_id']}, camera {job.get('webcam_id')}")
+
+    # Start database coordinator and stations
+    ctx = multiprocessing.get_context("spawn")
+    stop_event = ctx.Event()
+    db_queue = ctx.Queue()
+    reply_queues = [ctx.Queue() for _ in jobs]
+    event_queue = ctx.Queue()
+    frame_queues = [ctx.Queue(maxsize=2) for _ in jobs]
+    command_queues = [ctx.Queue() for _ in jobs]
+    coordinator = ctx.Process(
+        target=tube_data.run_db_coordinator,
+        args=(db_queue, reply_queues),
+        name="db_coordinator",
+    )
+    coordinator.start()
+    processes = []
+    for i, job in enumerate(jobs):
+        p = ctx.Process(
+            target=run_station,
+            args=(
+                i,
+                cfg.main.get_config_dict(),
+                job,
+                args.auto,
+                (tile_w, tile_h),
+                frame_queues[i],
+                event_queue,
+                command_queues[i],
+                db_queue,
+                reply_queues[i],
+                stop_event,
+            ),
+            name=f"station_{i + 1}",
+        )
+        p.start()
+        processes.append(p)
+
+    # Tiled monitor
+    test_sound = utils.Test_Sound(enable=cfg.main.sound.enable)
+    canvas = np.zeros((n_rows * tile_h, n_cols * tile_w, 3), dtype=np.uint8)
+    selected = 0
+    start_time = time.perf_counter()
+    while any(p.is_alive() for p in processes):
+        for i, frame_queue in enumerate(frame_queues):
+            try:
+                tile = frame_queue.get_nowait()
+            except queue.Empty:
+                continue
+            r, c = divmod(i, n_cols)
+            canvas[r * tile_h : (r + 1) * tile_h, c * tile_w : (c + 1) * tile_w] = tile
+        while True:
+            try:
+                index, action, status = event_queue.get_nowait()
+            except queue.Empty:
+                break
+            if action == "record":
+                if status == "PASS":
+                    test_sound.add()
+                else:
+                    test_sound.error()
+            elif action == "delete":
+                test_sound.remove()
+        display_img = canvas.copy()
+        r, c = divmod(selected, n_cols)
+        cv2.rectangle(
+            display_img,
+            (c * tile_w, r * tile_h),
+            ((c + 1) * tile_w - 1, (r + 1) * tile_h - 1),
+            (0, 255, 255),
+            2,
+        )
+        cv2.imshow("Monitor", display_img)
+        # React to keyboard inputs: 1-9 select station, others go to selected one
+        ky = cv2.waitKey(cfg.main.interval)
+        if ky == ord("q"):
+            logger.info("Exiting program ...")
+            break
+        elif ord("1") <= ky < ord("1") + n_stations:
+            selected = ky - ord("1")
+            logger.info(f"Station {selected + 1} selected")
+        elif ky in (ord("\r"), ord("d"), ord("r"), ord("c")):
+            command_queues[selected].put(ky)
+
+    # Release and Disconnect
+    stop_event.set()
+    for p in processes:
+        p.join()
+    db_queue.put(None)
+    coordinator.join()
+    test_sound.close()
+    cv2.destroyAllWindows()
+    time_consumed = time.perf_counter() - start_time
+    time_consumed_str = time.strftime("%H:%M:%S", time.gmtime(time_consumed))
+    logger.info(f"Time consumed: {time_consumed_str}")
+    logger.info("Done!")
+    logger.info("#" * 80)
+
+
+if __name__ == "__main__":
+    main()
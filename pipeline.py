@@ -0,0 +1,304 @@
+import collections
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger("bend_tester")
+
+DROP_POLICIES = ("oldest", "newest", "block")
+
+
+class Drop_Queue(object):
+    """Bounded FIFO queue connecting two pipeline stages
+
+    Drop Policy:
+        oldest: discard the oldest queued item to make room (freshest data wins)
+        newest: discard the incoming item when the queue is full
+        block: block the producer until there is room (no frame is lost)
+    """
+
+    def __init__(self, maxsize=2, policy="oldest") -> None:
+        super().__init__()
+        if policy not in DROP_POLICIES:
+            logger.critical(
+                f"Unknown drop policy: {policy}, supported: {DROP_POLICIES}"
+            )
+            raise ValueError
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.dropped = 0
+        self.closed = False
+        self._items = collections.deque()
+        self._cond = threading.Condition()
+
+    def put(self, item) -> bool:
+        """Puts item into queue, returns False if an item was dropped"""
+        with self._cond:
+            dropped = False
+            if self.policy == "block":
+                while len(self._items) >= self.maxsize and not self.closed:
+                    self._cond.wait()
+            elif len(self._items) >= self.maxsize:
+                self.dropped += 1
+                dropped = True
+                if self.policy == "newest":
+                    return False
+                self._items.popleft()
+            if self.closed:
+                return False
+            self._items.append(item)
+            self._cond.notify_all()
+            return not dropped
+
+    def get(self, timeout=None):
+        """Gets oldest item, returns None if timeout or queue closed and empty"""
+        with self._cond:
+            if not self._items and not self.closed:
+                self._cond.wait(timeout)
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def close(self) -> None:
+        """Wakes up all waiting producers/consumers, no more item is accepted"""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class Frame(object):
+    """Frame travelling through the pipeline
+
+    img is the captured frame, replaced by the display-scaled one when processed
+    """
+
+    __slots__ = ("frame_id", "t_capture", "img", "border_img", "x", "record")
+
+    def __init__(self, frame_id, t_capture, img) -> None:
+        super().__init__()
+        self.frame_id = frame_id
+        self.t_capture = t_capture
+        self.img = img
+        self.border_img = None
+        self.x = None
+        self.record = None
+
+
+class Frame_Grabber(threading.Thread):
+    """Capture stage, reads frames as fast as the source delivers them
+
+    Args:
+        read_func (callable): returns next image or None when source is exhausted
+        out_queue (Drop_Queue): queue to the processing stage
+        interval (float): minimum period between reads in seconds, paces
+            recorded videos, 0 for live sources
+    """
+
+    def __init__(self, read_func, out_queue, stop_event, interval=0) -> None:
+        super().__init__(name="frame_grabber", daemon=True)
+        self.read_func = read_func
+        self.out_queue = out_queue
+        self.stop_event = stop_event
+        self.interval = interval
+        self.frame_count = 0
+
+    def run(self) -> None:
+        t_next = time.perf_counter()
+        try:
+            while not self.stop_event.is_set():
+                if self.interval:
+                    delay = t_next - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    # no catching up after a blocked put
+                    t_next = max(t_next, time.perf_counter()) + self.interval
+                img = self.read_func()
+                if img is None:
+                    logger.critical("no video captured")
+                    break
+                frame = Frame(self.frame_count, time.perf_counter(), img)
+                self.frame_count += 1
+                self.out_queue.put(frame)
+        finally:
+            self.out_queue.close()
+
+
+class Process_Worker(threading.Thread):
+    """Processing stage, runs border detection and the state machine
+
+    Args:
+        station (station.Station): station to process frames with
+        lock (threading.Lock): guards station against concurrent key handling
+        record_queue (queue.SimpleQueue): receives the (status, dy) of every
+            recorded tube, unbounded so no record is lost with its frame
+    """
+
+    def __init__(
+        self, station, in_queue, out_queue, lock, stop_event, record_queue
+    ) -> None:
+        super().__init__(name="process_worker", daemon=True)
+        self.station = station
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.lock = lock
+        self.stop_event = stop_event
+        self.record_queue = record_queue
+
+    def run(self) -> None:
+        try:
+            while not self.stop_event.is_set():
+                frame = self.in_queue.get(timeout=0.1)
+                if frame is None:
+                    if self.in_queue.closed:
+                        break
+                    continue
+                with self.lock:
+                    (
+                        frame.img,
+                        frame.border_img,
+                        frame.x,
+                        frame.record,
+                    ) = self.station.process(frame.img)
+                if frame.record:
+                    self.record_queue.put(frame.record)
+                self.out_queue.put(frame)
+        except Exception:
+            logger.exception("Processing worker failed")
+        finally:
+            self.out_queue.close()
+
+
+class Latency_Monitor(object):
+    """Collects end-to-end latency and dropped-frame counts of the pipeline"""
+
+    def __init__(self, queues, report_interval=10) -> None:
+        super().__init__()
+        self.queues = queues
+        self.report_interval = report_interval
+        self.reset()
+        self.total_frames = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def reset(self) -> None:
+        self.t_report = time.perf_counter()
+        self.frames = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def add(self, frame) -> None:
+        latency = time.perf_counter() - frame.t_capture
+        self.frames += 1
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.total_frames += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        if time.perf_counter() - self.t_report >= self.report_interval:
+            self.report()
+            self.reset()
+
+    def get_dropped(self) -> dict:
+        return {name: queue.dropped for name, queue in self.queues.items()}
+
+    def report(self) -> None:
+        period = time.perf_counter() - self.t_report
+        if self.frames:
+            logger.info(
+                f"Pipeline: {self.frames / period:.1f} fps, "
+                f"latency avg = {self.latency_sum / self.frames * 1000:.1f} ms, "
+                f"max = {self.latency_max * 1000:.1f} ms, dropped = {self.get_dropped()}"
+            )
+
+    def summary(self) -> None:
+        if self.total_frames:
+            logger.info(
+                f"Pipeline summary: {self.total_frames} frames displayed, "
+                f"latency avg = {self.total_latency / self.total_frames * 1000:.1f} ms, "
+                f"max = {self.max_latency * 1000:.1f} ms, dropped = {self.get_dropped()}"
+            )
+
+
+class Pipeline(object):
+    """Capture -> process -> display pipeline connected by bounded queues
+
+    Capture and processing run in background threads, the display stage is
+    driven from the main thread (OpenCV GUI calls must stay there) through
+    get_frame().
+    """
+
+    def __init__(self, read_func, station, cfg) -> None:
+        super().__init__()
+        cp = cfg.main.pipeline
+        queue_size = cp.queue_size or 2
+        policy = cp.drop_policy or "oldest"
+        # recorded videos are played at interval like the sequential loop and
+        # none of their frames is dropped before processing
+        interval = 0
+        capture_policy = policy
+        if not cfg.job.webcam:
+            interval = cfg.main.interval / 1000
+            capture_policy = "block"
+        # border images are reused in turn, keep enough of them for all frames
+        # queued for display plus the one shown and the one being processed
+        station.detector.n_outputs = max(station.detector.n_outputs, queue_size + 2)
+        if station.idle_detector:
+            station.idle_detector.n_outputs = station.detector.n_outputs
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.capture_queue = Drop_Queue(queue_size, capture_policy)
+        self.display_queue = Drop_Queue(queue_size, policy)
+        self.grabber = Frame_Grabber(
+            read_func, self.capture_queue, self.stop_event, interval
+        )
+        self.record_queue = queue.SimpleQueue()
+        self.worker = Process_Worker(
+            station,
+            self.capture_queue,
+            self.display_queue,
+            self.lock,
+            self.stop_event,
+            self.record_queue,
+        )
+        self.monitor = Latency_Monitor(
+            {"capture": self.capture_queue, "display": self.display_queue},
+            report_interval=cp.report_interval or 10,
+        )
+
+    def start(self) -> None:
+        self.grabber.start()
+        self.worker.start()
+
+    def get_frame(self, timeout=0.1):
+        """Returns next processed frame, None if not ready yet"""
+        frame = self.display_queue.get(timeout=timeout)
+        if frame is not None:
+            self.monitor.add(frame)
+        return frame
+
+    def get_records(self) -> list:
+        """Returns (status, dy) of tubes recorded since last call
+
+        Frames may be dropped before display, their records are not.
+        """
+        records = []
+        while not self.record_queue.empty():
+            records.append(self.record_queue.get())
+        return records
+
+    def is_running(self) -> bool:
+        return not self.display_queue.closed or len(self.display_queue) > 0
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.capture_queue.close()
+        self.display_queue.close()
+        self.grabber.join(timeout=1)
+        self.worker.join(timeout=1)
+        self.monitor.summary()
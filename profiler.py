@@ -0,0 +1,133 @@
+import collections
+import csv
+import json
+import logging
+import pathlib
+import threading
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger("bend_tester")
+
+
+class Stage_Timer(object):
+    """Collects rolling per-stage latencies
+
+    Usage:
+        t = time.perf_counter()
+        ...  # stage work
+        t = timer.lap("stage_name", t)
+
+    Callers guard every call with "if timer", so profiling costs nothing
+    when it is turned off.
+    """
+
+    def __init__(self, cfg) -> None:
+        super().__init__()
+        cp = cfg.main.profile
+        self.window = cp.window or 300
+        self.overlay = cp.overlay
+        self.export = cp.export
+        self.export_interval = cp.export_interval or 30
+        self.export_path = None
+        if self.export in ("csv", "json"):
+            out_dir = pathlib.Path(cfg.job.output_dir)
+            out_dir.mkdir(parents=True, exist_ok=True)
+            self.export_path = out_dir / f"{cfg.job.box_id}_timing.{self.export}"
+        elif self.export:
+            logger.warning(f"Unknown profile export format: {self.export}, skipped")
+        self.samples = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._t_export = time.perf_counter()
+        self._t_overlay = 0
+        self._overlay_lines = []
+
+    def lap(self, stage, t0) -> float:
+        """Records time since t0 for stage, returns current time for chaining"""
+        t1 = time.perf_counter()
+        with self._lock:
+            if stage not in self.samples:
+                self.samples[stage] = collections.deque(maxlen=self.window)
+            self.samples[stage].append(t1 - t0)
+        return t1
+
+    def get_summary(self) -> dict:
+        """Returns rolling latency statistics in ms for each stage"""
+        with self._lock:
+            samples = {k: np.array(v) * 1000 for k, v in self.samples.items() if v}
+        summary = collections.OrderedDict()
+        for stage, arr in samples.items():
+            p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+            summary[stage] = {
+                "count": len(arr),
+                "mean": float(arr.mean()),
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+                "max": float(arr.max()),
+            }
+        return summary
+
+    def print(self) -> None:
+        print(f"{'stage':<12}{'mean':>8}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}  (ms)")
+        for stage, s in self.get_summary().items():
+            print(
+                f"{stage:<12}{s['mean']:>8.2f}{s['p50']:>8.2f}{s['p95']:>8.2f}{s['p99']:>8.2f}{s['max']:>8.2f}"
+            )
+
+    def draw_overlay(self, img, refresh=0.5):
+        """Draws p50/p95/p99 of every stage at top right corner of image"""
+        if not self.overlay:
+            return img
+        now = time.perf_counter()
+        if now - self._t_overlay >= refresh:
+            self._t_overlay = now
+            self._overlay_lines = [
+                f"{stage:<10}{s['p50']:6.1f}{s['p95']:6.1f}{s['p99']:6.1f}"
+                for stage, s in self.get_summary().items()
+            ]
+            self._overlay_lines.insert(0, f"{'ms':<10}{'p50':>6}{'p95':>6}{'p99':>6}")
+        x = img.shape[1] - 260
+        for i, line in enumerate(self._overlay_lines):
+            cv2.putText(
+                img,
+                line,
+                (x, 15 + 14 * i),
+                cv2.FONT_HERSHEY_PLAIN,
+                0.9,
+                (0, 255, 255),
+            )
+        return img
+
+    def update(self) -> None:
+        """Exports summary if export interval has passed, call once per frame"""
+        if self.export_path and time.perf_counter() - self._t_export >= self.export_interval:
+            self.export_summary()
+
+    def export_summary(self) -> None:
+        self._t_export = time.perf_counter()
+        summary = self.get_summary()
+        if not summary or not self.export_path:
+            return
+        time_string = datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+        if self.export == "csv":
+            new_file = not self.export_path.exists()
+            with open(self.export_path, "a", newline="") as f:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(
+                        ["time", "stage", "count", "mean", "p50", "p95", "p99", "max"]
+                    )
+                for stage, s in summary.items():
+                    writer.writerow(
+                        [time_string, stage, s["count"]]
+                        + [f"{s[k]:.3f}" for k in ("mean", "p50", "p95", "p99", "max")]
+                    )
+        else:
+            # one json object per line
+            with open(self.export_path, "a") as f:
+                f.write(json.dumps({"time": time_string, "stages": summary}) + "\n")
+        logger.debug(f"Timing summary exported to {self.export_path}")
@@ -0,0 +1,263 @@
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import analysis
+import config
+import station
+
+logging_format = "%(asctime)s,%(msecs)03d - %(levelname)s - %(message)s"
+logger = logging.getLogger("bend_tester")
+
+# detection station of a worker process
+_tester = None
+
+
+def init_worker(cfg_dict):
+    global _tester
+    cfg = config.Config(cfg_dict)
+    _tester = station.Station(cfg)
+    # one OpenCV thread per worker, the pool already uses all cores
+    cv2.setNumThreads(1)
+
+
+def detect_chunk(video_path, start, stop) -> dict:
+    """Runs border detection on frames [start, stop) of video
+
+    Returns:
+        dict: start, detected x of each frame (nan if none) and display shape
+    """
+    cap = cv2.VideoCapture(video_path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    xs = np.full(stop - start, np.nan)
+    shape = None
+    for i in range(stop - start):
+        success, frame = cap.read()
+        if not success:
+            xs = xs[:i]
+            break
+        img, process_img = _tester.prepare(frame)
+        shape = img.shape
+        _, x = _tester.detect(process_img, img.shape)
+        if x is not None:
+            xs[i] = x
+    cap.release()
+    return {"start": start, "xs": xs, "shape": shape}
+
+
+def run_state_machine(cfg, xs, shape, fps) -> list:
+    """Runs auto mode state machine over x series, timed by frame index
+
+    Returns:
+        list: dict of each recorded tube
+    """
+    tubes = []
+    cfg = cfg.clone()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cfg.job.output_dir = temp_dir
+        tester = station.Station(cfg, auto=True)
+        tester.setup(np.zeros(shape, dtype=np.uint8))
+        tube_cache = tester.tube_cache
+        for i, x in enumerate(xs):
+            record = tester.update(None if np.isnan(x) else x, i / fps)
+            if record:
+                tubes.append(
+                    {
+                        "frame": i,
+                        "status": record[0],
+                        "up_pix": tube_cache.get_limits()[1],
+                        "low_pix": tube_cache.get_limits()[0],
+                        "dy": record[1],
+                    }
+                )
+        tester.close()
+    return tubes
+
+
+def select_stored(stored, first_tube=None, date=None) -> dict:
+    """Selects stored rows of the re-analysed session
+
+    Box databases hold all sessions of a box, rows are kept from tube id
+    first_tube on and of the given "YYYY/MM/DD" date.
+    """
+    mask = np.ones(len(stored["tube_id"]), dtype=bool)
+    if first_tube is not None:
+        mask &= stored["tube_id"] >= first_tube
+    if date:
+        mask &= stored["date"] == analysis.parse_date([date])[0]
+    return analysis.select(stored, mask)
+
+
+def diff_tubes(tubes, stored) -> list:
+    """Pairs re-analysed tubes with stored rows in tube id order"""
+    order = np.argsort(stored["tube_id"], kind="stable")
+    rows = []
+    for i in range(max(len(tubes), len(order))):
+        row = {"new": tubes[i] if i < len(tubes) else None, "stored": None}
+        if i < len(order):
+            j = order[i]
+            row["stored"] = {
+                "tube_id": int(stored["tube_id"][j]),
+                "status": str(stored["status"][j]),
+                "up_pix": float(stored["up_pix"][j]),
+                "low_pix": float(stored["low_pix"][j]),
+                "dy": float(stored["dy"][j]),
+            }
+        rows.append(row)
+    return rows
+
+
+def main():
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description="Re-analyse recorded videos in parallel and diff against box databases"
+    )
+    parser.add_argument("job_configs", nargs="+", help="job yaml(s) of recorded videos")
+    parser.add_argument(
+        "-m",
+        "--main-config",
+        default="share/main/main.yaml",
+        help="main config with the detection parameters to evaluate",
+    )
+    parser.add_argument("-j", "--workers", type=int, default=None, help="processes")
+    parser.add_argument(
+        "--chunk", type=int, default=300, help="frames per detection task"
+    )
+    parser.add_argument(
+        "-d",
+        "--db-dir",
+        default=None,
+        help="directory of box databases to compare with, job output_dir if not set",
+    )
+    parser.add_argument(
+        "--first-tube",
+        type=int,
+        default=None,
+        help="compare with stored tubes from this tube id on (session start)",
+    )
+    parser.add_argument(
+        "--date",
+        default=None,
+        help="compare with stored tubes of this date only (YYYY/MM/DD)",
+    )
+    parser.add_argument("--json", default=None, help="save results to json file")
+    args = parser.parse_args()
+    logging.basicConfig(format=logging_format, datefmt="%Y-%m-%d:%H:%M:%S")
+    logger.setLevel(logging.INFO)
+
+    main_dict = config.load_yaml_dict(yaml_path=args.main_config)
+    results = []
+    for job_yaml in args.job_configs:
+        cfg = config.Config(main_dict)
+        cfg.update(config.load_yaml_dict(yaml_path=job_yaml))
+        cj = cfg.job
+        # frames are detected independently, ROI tracking needs the previous
+        # frame and evidence / profiling are not wanted offline
+        cfg.main.roi.enable = False
+        cfg.main.evidence.enable = False
+        cfg.main.profile.enable = False
+        cap = cv2.VideoCapture(cj.video_path)
+        n_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        cap.release()
+        if n_frames <= 0:
+            logger.error(f"Can't read frame count of {cj.video_path}, skipped")
+            continue
+        logger.info(f"Re-analysing {cj.video_path}: {n_frames} frames, box {cj.box_id}")
+
+        # Detect in process pool
+        start_time = time.perf_counter()
+        starts = range(0, n_frames, args.chunk)
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=args.workers or os.cpu_count(),
+            initializer=init_worker,
+            initargs=(
+                {"main": cfg.main.get_config_dict(), "job": cj.get_config_dict()},
+            ),
+        ) as executor:
+            chunks = list(
+                executor.map(
+                    detect_chunk,
+                    [cj.video_path] * len(starts),
+                    starts,
+                    [min(s + args.chunk, n_frames) for s in starts],
+                )
+            )
+        xs = np.concatenate([c["xs"] for c in chunks])
+        shape = next(c["shape"] for c in chunks if c["shape"] is not None)
+        detect_time = time.perf_counter() - start_time
+        logger.info(
+            f"Detected {len(xs)} frames in {detect_time:.1f} s "
+            f"({len(xs) / detect_time:.1f} fps)"
+        )
+
+        # Sequential state machine and comparison
+        tubes = run_state_machine(cfg, xs, shape, fps)
+        db_path = pathlib.Path(args.db_dir or cj.output_dir) / f"{cj.box_id}.db"
+        if db_path.exists():
+            stored = analysis.read_box_db(db_path)
+        else:
+            logger.warning(f"No database {db_path} to compare with")
+            stored = analysis.empty_columns()
+        stored = select_stored(stored, args.first_tube, args.date)
+        if len(stored["tube_id"]) != len(tubes):
+            logger.warning(
+                f"{len(stored['tube_id'])} stored tubes selected for {len(tubes)} "
+                "re-analysed, pairs may belong to different sessions "
+                "(select them with --first-tube / --date)"
+            )
+        rows = diff_tubes(tubes, stored)
+        results.append({"config": job_yaml, "box": cj.box_id, "tubes": rows})
+
+        # Report
+        print("")
+        print(
+            f"Box {cj.box_id}: {len(tubes)} tubes re-analysed, "
+            f"{len(stored['tube_id'])} stored selected"
+        )
+        print(
+            f"{'tube':>6}{'stored':>8}{'dy':>9}{'up':>8}{'low':>8}"
+            f"{'new':>8}{'dy':>9}{'up':>8}{'low':>8}{'d dy':>9}"
+        )
+        n_flipped = 0
+        d_dy = []
+        for row in rows:
+            old, new = row["stored"], row["new"]
+            line = f"{old['tube_id'] if old else '-':>6}"
+            if old:
+                line += f"{old['status']:>8}{old['dy']:>9.3f}{old['up_pix']:>8.1f}{old['low_pix']:>8.1f}"
+            else:
+                line += f"{'-':>8}{'':>25}"
+            if new:
+                line += f"{new['status']:>8}{new['dy']:>9.3f}{new['up_pix']:>8.1f}{new['low_pix']:>8.1f}"
+            else:
+                line += f"{'-':>8}{'':>25}"
+            if old and new:
+                d_dy.append(new["dy"] - old["dy"])
+                line += f"{d_dy[-1]:>9.3f}"
+                if new["status"] != old["status"]:
+                    n_flipped += 1
+                    line += "  *"
+            print(line)
+        if d_dy:
+            print(
+                f"Status changed: {n_flipped}/{len(d_dy)}, "
+                f"mean |d dy| = {np.mean(np.abs(d_dy)):.3f} mm, "
+                f"max |d dy| = {np.max(np.abs(d_dy)):.3f} mm"
+            )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+        logger.info(f"Results saved to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
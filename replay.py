@@ -0,0 +1,208 @@
+import argparse
+import json
+import logging
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import config
+import station
+
+# Parse arguments
+parser = argparse.ArgumentParser(
+    description="Replay a recorded video headless (no display, no sound) as fast as possible"
+)
+parser.add_argument("yaml_config", action="store")
+parser.add_argument(
+    "-a",
+    "--auto",
+    required=False,
+    help="run in auto mode",
+    action="store_true",
+)
+parser.add_argument(
+    "-n",
+    "--max-frames",
+    type=int,
+    default=0,
+    help="max number of frames to replay, 0 for all",
+)
+parser.add_argument(
+    "-o",
+    "--output-dir",
+    default=None,
+    help="directory for the box database, a temporary directory is used if not set",
+)
+parser.add_argument(
+    "--profile",
+    required=False,
+    help="also report latencies of the get_border sub-stages",
+    action="store_true",
+)
+parser.add_argument(
+    "--wall-clock",
+    required=False,
+    help="time auto mode with wall clock instead of video timestamps",
+    action="store_true",
+)
+parser.add_argument(
+    "--trace",
+    default=None,
+    help="save auto mode state transitions to csv file",
+)
+parser.add_argument(
+    "--json",
+    default=None,
+    help="save benchmark results to json file",
+)
+args = parser.parse_args()
+# set logging format
+logging_format = "%(asctime)s,%(msecs)03d - %(levelname)s - %(message)s"
+logging.basicConfig(format=logging_format, datefmt="%Y-%m-%d:%H:%M:%S")
+logger = logging.getLogger("bend_tester")
+logger.setLevel(logging.INFO)
+
+# Load configs
+logger.info("#" * 80)
+logger.info(f"Replaying: {args.yaml_config}")
+main = config.load_yaml_dict(yaml_path="share/main/main.yaml")
+cfg = config.Config(main)
+job = config.load_yaml_dict(yaml_path=args.yaml_config)
+cfg.update(job)
+cfg.main.profile.enable = args.profile
+cfg.main.profile.export = None
+cfg.main.profile.window = args.max_frames or 100000
+cj = cfg.job
+temp_dir = None
+if args.output_dir:
+    cj.output_dir = args.output_dir
+else:
+    temp_dir = tempfile.TemporaryDirectory()
+    cj.output_dir = temp_dir.name
+
+# Replay loop
+stages = ("read", "resize", "detect", "update")
+timings = {stage: [] for stage in stages}
+measurements = []
+tester = station.Station(cfg, auto=args.auto)
+cap = cv2.VideoCapture(cj.video_path)
+video_fps = cap.get(cv2.CAP_PROP_FPS) or 30
+frame_count = 0
+now = None
+start_time = time.perf_counter()
+while not args.max_frames or frame_count < args.max_frames:
+    t0 = time.perf_counter()
+    success, img = cap.read()
+    if not success:
+        break
+    if not args.wall_clock:
+        # video timestamp, frame count based if not provided by the backend
+        pos = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        if now is not None and pos <= now:
+            pos = now + 1 / video_fps
+        now = pos
+    t1 = time.perf_counter()
+    img, process_img = tester.prepare(img)
+    t2 = time.perf_counter()
+    if tester.tube_cache is None:
+        tester.setup(img)
+    border_img, x = tester.detect_frame(img, process_img)
+    t3 = time.perf_counter()
+    record = tester.update(x, now)
+    t4 = time.perf_counter()
+    for stage, dt in zip(stages, (t1 - t0, t2 - t1, t3 - t2, t4 - t3)):
+        timings[stage].append(dt)
+    frame_count += 1
+    if record:
+        tube_cache = tester.tube_cache
+        measurements.append(
+            {
+                "frame": frame_count - 1,
+                "tube_id": tube_cache.tube_id - 1,
+                "status": record[0],
+                "up_pix": tube_cache.get_limits()[1],
+                "low_pix": tube_cache.get_limits()[0],
+                "dy": record[1],
+            }
+        )
+total_time = time.perf_counter() - start_time
+if not args.auto and tester.tube_cache is not None:
+    tube_cache = tester.tube_cache
+    status, dy = tube_cache.get_tube_data()
+    measurements.append(
+        {
+            "frame": frame_count - 1,
+            "tube_id": tube_cache.tube_id,
+            "status": status,
+            "up_pix": tube_cache.get_limits()[1],
+            "low_pix": tube_cache.get_limits()[0],
+            "dy": dy,
+        }
+    )
+cap.release()
+state_times = tester.job_cache.get_state_times()
+if args.trace:
+    tester.job_cache.export_trace(args.trace)
+    logger.info(f"State transitions saved to {args.trace}")
+tester.close()
+if temp_dir:
+    temp_dir.cleanup()
+if not frame_count:
+    logger.critical("no video captured")
+    exit()
+
+# Report
+fps = frame_count / total_time
+print("")
+print(f"Frames: {frame_count}, time: {total_time:.2f} s, {fps:.1f} fps")
+print(f"{'stage':<10}{'mean ms':>10}{'p95 ms':>10}{'max ms':>10}{'share':>8}")
+stage_results = {}
+busy_time = sum(sum(values) for values in timings.values())
+for stage, values in timings.items():
+    arr = np.array(values) * 1000
+    stage_results[stage] = {
+        "mean_ms": float(arr.mean()),
+        "p95_ms": float(np.percentile(arr, 95)),
+        "max_ms": float(arr.max()),
+    }
+    print(
+        f"{stage:<10}{arr.mean():>10.2f}{np.percentile(arr, 95):>10.2f}{arr.max():>10.2f}"
+        f"{arr.sum() / 1000 / busy_time:>8.1%}"
+    )
+if tester.timer:
+    print("")
+    tester.timer.print()
+if args.auto:
+    print("")
+    print(f"{'state':<12}{'time s':>10}{'share':>8}")
+    total_state_time = max(sum(state_times.values()), 1e-9)
+    for name in tester.job_cache.state_dict.values():
+        if name not in state_times:
+            continue
+        t = state_times[name]
+        print(f"{name:<12}{t:>10.2f}{t / total_state_time:>8.1%}")
+print("")
+print(f"Tubes measured: {len(measurements)}")
+for m in measurements:
+    print(
+        f"    tube {m['tube_id']:>4}: {m['status']:<7} dy = {m['dy'] * 1000:8.1f} um"
+        f"  (up = {m['up_pix']}, low = {m['low_pix']}, frame {m['frame']})"
+    )
+if args.json:
+    results = {
+        "config": args.yaml_config,
+        "auto": args.auto,
+        "frames": frame_count,
+        "time": total_time,
+        "fps": fps,
+        "stages": stage_results,
+        "measurements": measurements,
+        "state_times": state_times,
+    }
+    if tester.timer:
+        results["sub_stages"] = tester.timer.get_summary()
+    with open(args.json, "w") as f:
+        json.dump(results, f, indent=4)
+    logger.info(f"Results saved to {args.json}")
@@ -0,0 +1,208 @@
+import argparse
+import logging
+import re
+
+import numpy as np
+
+import analysis
+
+# Parse arguments
+parser = argparse.ArgumentParser(
+    description="Cross-box report over all box databases in the run directory"
+)
+parser.add_argument("-d", "--run-dir", default="run", help="directory of box databases")
+parser.add_argument("-b", "--box", nargs="+", default=None, help="only report these boxes")
+parser.add_argument("--since", default=None, help="first day to include, YYYY/MM/DD")
+parser.add_argument("--until", default=None, help="last day to include, YYYY/MM/DD")
+parser.add_argument(
+    "--bin-width", type=float, default=0.1, help="dy histogram bin width in mm"
+)
+parser.add_argument(
+    "--no-cache",
+    required=False,
+    help="always re-read databases instead of using the summary cache",
+    action="store_true",
+)
+parser.add_argument("-j", "--workers", type=int, default=None, help="parallel readers")
+parser.add_argument(
+    "--idle-gap",
+    type=float,
+    default=60,
+    help="WAIT periods longer than this (second) count as operator idle gaps",
+)
+parser.add_argument(
+    "-A",
+    "--archive",
+    default=None,
+    help="read archive written by archive.py instead of the box databases",
+)
+args = parser.parse_args()
+# set logging format
+logging_format = "%(asctime)s,%(msecs)03d - %(levelname)s - %(message)s"
+logging.basicConfig(format=logging_format, datefmt="%Y-%m-%d:%H:%M:%S")
+logger = logging.getLogger("bend_tester")
+logger.setLevel(logging.INFO)
+
+
+def print_group_stats(title, keys, data):
+    """Prints pass/fail and dy statistics grouped by keys"""
+    print("")
+    print(
+        f"{title:<24}{'tests':>7}{'pass':>7}{'fail':>7}{'fail%':>8}"
+        f"{'dy mean':>9}{'dy p95':>9}{'dy max':>9}"
+    )
+    for key in np.unique(keys):
+        mask = keys == key
+        status = data["status"][mask]
+        dy = data["dy"][mask]
+        n_pass = int(np.sum(status == "PASS"))
+        n_fail = int(np.sum(status == "FAIL"))
+        n = len(status)
+        print(
+            f"{str(key):<24}{n:>7}{n_pass:>7}{n_fail:>7}{n_fail / n:>8.1%}"
+            f"{np.nanmean(dy):>9.3f}{np.nanpercentile(dy, 95):>9.3f}{np.nanmax(dy):>9.3f}"
+        )
+
+
+# Load data
+if args.archive:
+    data = analysis.load_archive(args.archive)
+else:
+    data = analysis.load_run_dir(
+        args.run_dir, use_cache=not args.no_cache, workers=args.workers
+    )
+mask = np.ones(len(data["box"]), dtype=bool)
+if args.box:
+    mask &= np.isin(data["box"], args.box)
+if args.since:
+    mask &= data["date"] >= analysis.parse_date([args.since])[0]
+if args.until:
+    mask &= data["date"] <= analysis.parse_date([args.until])[0]
+data = analysis.select(data, mask)
+n_rows = len(data["box"])
+if not n_rows:
+    logger.warning("No test found")
+    exit()
+
+# Overall
+status = data["status"]
+dy = data["dy"]
+n_fail = int(np.sum(status == "FAIL"))
+print("")
+print(
+    f"Tests: {n_rows}, boxes: {len(np.unique(data['box']))}, "
+    f"days: {data['date'].min()} ~ {data['date'].max()}"
+)
+print(f"Fail rate: {n_fail}/{n_rows} = {n_fail / n_rows:.2%}")
+
+# Grouped stats
+print_group_stats("box", data["box"], data)
+print_group_stats("day", data["date"], data)
+# tests done by several operators count for each of them
+operators = [re.split(r"\s*[&,]\s*", o) for o in data["operator"]]
+counts = np.array([len(o) for o in operators])
+op_keys = np.array([name for o in operators for name in o])
+op_data = analysis.select(data, np.repeat(np.arange(n_rows), counts))
+print_group_stats("operator", op_keys, op_data)
+
+# dy histogram
+print("")
+print("dy distribution (mm)")
+valid_dy = dy[~np.isnan(dy)]
+edges = np.arange(0, valid_dy.max() + args.bin_width, args.bin_width)
+hist, edges = np.histogram(valid_dy, bins=edges)
+scale = 50 / max(1, hist.max())
+for lo, hi, n in zip(edges[:-1], edges[1:], hist):
+    print(f"    {lo:5.2f} - {hi:5.2f} {n:>6} {'#' * int(np.ceil(n * scale))}")
+
+# Repeated measurements of same tube
+pairs = np.rec.fromarrays([data["box"], data["tube_id"]], names="box,tube_id")
+unique_pairs, repeat = np.unique(pairs, return_counts=True)
+repeated = unique_pairs[repeat > 1]
+print("")
+print(f"Tubes measured more than once: {len(repeated)} / {len(unique_pairs)}")
+for pair, n in zip(repeated, repeat[repeat > 1]):
+    sel = (data["box"] == pair.box) & (data["tube_id"] == pair.tube_id)
+    results = ", ".join(
+        f"{s} {d:.2f}" for s, d in zip(data["status"][sel], data["dy"][sel])
+    )
+    print(f"    box {pair.box} tube {pair.tube_id}: {n} times ({results})")
+
+# Cycle times from auto mode state transitions
+if args.archive:
+    exit()
+trans = analysis.load_transitions(args.run_dir, workers=args.workers)
+mask = np.ones(len(trans["box"]), dtype=bool)
+if args.box:
+    mask &= np.isin(trans["box"], args.box)
+if args.since or args.until:
+    trans_date = analysis.unix_to_date(trans["time"])
+    if args.since:
+        mask &= trans_date >= analysis.parse_date([args.since])[0]
+    if args.until:
+        mask &= trans_date <= analysis.parse_date([args.until])[0]
+trans = analysis.select(trans, mask)
+if not len(trans["box"]):
+    exit()
+auto = trans["cause"] == "auto"
+print("")
+print("Time per tube in each state (s, auto mode)")
+print(f"{'state':<12}{'tubes':>7}{'mean':>9}{'median':>9}{'p95':>9}{'share':>8}")
+states = ("WAIT", "PRE-TEST", "TEST", "POST-TEST")
+# total time of each (box, tube, state)
+keys = np.rec.fromarrays(
+    [trans["box"][auto], trans["tube_id"][auto], trans["from_state"][auto]],
+    names="box,tube_id,state",
+)
+unique_keys, inverse = np.unique(keys, return_inverse=True)
+totals = np.bincount(inverse, weights=trans["period"][auto])
+cycle_total = totals[np.isin(unique_keys.state, states)].sum()
+for state in states:
+    values = totals[unique_keys.state == state]
+    if not values.size:
+        continue
+    print(
+        f"{state:<12}{values.size:>7}{values.mean():>9.1f}{np.median(values):>9.1f}"
+        f"{np.percentile(values, 95):>9.1f}{values.sum() / cycle_total:>8.1%}"
+    )
+
+# Throughput and idle gaps
+recorded = (auto & (trans["to_state"] == "RECORD")) | (trans["cause"] == "record")
+wait = auto & (trans["from_state"] == "WAIT")
+idle = wait & (trans["period"] > args.idle_gap)
+print("")
+print(
+    f"{'box':<24}{'tubes':>7}{'tubes/h':>9}{'cycle s':>9}"
+    f"{'idle gaps':>11}{'idle h':>8}{'deletes':>9}{'resets':>8}"
+)
+for box in np.unique(trans["box"]):
+    in_box = trans["box"] == box
+    record_times = trans["time"][in_box & recorded]
+    n_tubes = len(record_times)
+    idle_time = trans["period"][in_box & idle].sum()
+    # a box database holds several sessions, the time between them is not
+    # active, sum the spans of the sessions starting with INITIAL
+    times = trans["time"][in_box]
+    starts = np.flatnonzero(trans["from_state"][in_box] == "INITIAL")
+    bounds = np.unique(np.concatenate(([0], starts, [len(times)])))
+    active_time = sum(
+        times[hi - 1] - times[lo] for lo, hi in zip(bounds[:-1], bounds[1:])
+    )
+    active_time -= idle_time
+    # median is not affected by the few cycles containing idle gaps
+    cycles = np.diff(record_times)
+    rate = f"{n_tubes / active_time * 3600:.1f}" if active_time > 0 else "-"
+    cycle = f"{np.median(cycles):.1f}" if cycles.size else "-"
+    print(
+        f"{str(box):<24}{n_tubes:>7}{rate:>9}{cycle:>9}"
+        f"{int(np.sum(in_box & idle)):>11}{idle_time / 3600:>8.2f}"
+        f"{int(np.sum(in_box & (trans['cause'] == 'delete'))):>9}"
+        f"{int(np.sum(in_box & (trans['cause'] == 'reset'))):>8}"
+    )
+n_recorded = max(1, int(np.sum(recorded)))
+n_delete = int(np.sum(trans["cause"] == "delete"))
+n_reset = int(np.sum(trans["cause"] == "reset"))
+print(
+    f"Retests (d): {n_delete / n_recorded:.1%}, resets (r): {n_reset / n_recorded:.1%} "
+    f"of {n_recorded} recorded tubes, idle gaps: WAIT > {args.idle_gap:g} s"
+)
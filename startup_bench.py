@@ -0,0 +1,85 @@
+import argparse
+import json
+import logging
+import re
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+# Parse arguments
+parser = argparse.ArgumentParser(
+    description="Measure startup time (time to first frame) of main.py over repeated launches"
+)
+parser.add_argument("yaml_config", action="store")
+parser.add_argument(
+    "-r",
+    "--repeat",
+    type=int,
+    default=5,
+    help="number of launches",
+)
+parser.add_argument(
+    "--gui",
+    required=False,
+    help="show the first frame on the Monitor window instead of running headless",
+    action="store_true",
+)
+parser.add_argument(
+    "--json",
+    default=None,
+    help="save benchmark results to json file",
+)
+args = parser.parse_args()
+# set logging format
+logging_format = "%(asctime)s,%(msecs)03d - %(levelname)s - %(message)s"
+logging.basicConfig(format=logging_format, datefmt="%Y-%m-%d:%H:%M:%S")
+logger = logging.getLogger("bend_tester")
+logger.setLevel(logging.INFO)
+
+command = [sys.executable, "main.py", "-n", "1", args.yaml_config]
+if not args.gui:
+    command.insert(2, "--headless")
+logger.info(f"Launching {args.repeat} times: {' '.join(command)}")
+
+# Launch main.py, in-process time to first frame is read from its log
+launches = []
+for i in range(args.repeat):
+    start_time = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True)
+    wall_time = time.perf_counter() - start_time
+    match = re.search(r"Time to first frame: ([\d.]+) s", result.stderr)
+    if result.returncode or not match:
+        logger.critical(f"Launch {i + 1} failed:\n{result.stderr}")
+        exit(1)
+    launches.append({"first_frame": float(match.group(1)), "wall": wall_time})
+    logger.info(
+        f"Launch {i + 1}: first frame after {launches[-1]['first_frame']:.3f} s, "
+        f"process {wall_time:.3f} s"
+    )
+
+# Report
+first_frame = np.array([launch["first_frame"] for launch in launches])
+wall = np.array([launch["wall"] for launch in launches])
+print("")
+print(f"{'':<28}{'min s':>8}{'median s':>10}{'max s':>8}")
+print(
+    f"{'time to first frame':<28}{first_frame.min():>8.3f}"
+    f"{np.median(first_frame):>10.3f}{first_frame.max():>8.3f}"
+)
+print(
+    f"{'process wall time':<28}{wall.min():>8.3f}{np.median(wall):>10.3f}{wall.max():>8.3f}"
+)
+print("(time to first frame excludes interpreter startup and module imports)")
+if args.json:
+    results = {
+        "config": args.yaml_config,
+        "gui": args.gui,
+        "launches": launches,
+        "first_frame_median": float(np.median(first_frame)),
+        "wall_median": float(np.median(wall)),
+    }
+    with open(args.json, "w") as f:
+        json.dump(results, f, indent=4)
+    logger.info(f"Results saved to {args.json}")
@@ -0,0 +1,380 @@
+import logging
+import time
+
+import cv2
+
+import evidence
+import profiler
+import tube_data
+import utils
+
+logger = logging.getLogger("bend_tester")
+
+
+class Station(object):
+    """Runs border detection and tube measurement for one camera
+
+    Holds the Job_Cache / Tube_Cache pair of a station so that the same
+    per-frame logic can be shared by the sequential loop in main.py and the
+    threaded pipeline.
+    """
+
+    def __init__(
+        self,
+        cfg,
+        auto=False,
+        debug=False,
+        writer_factory=None,
+        clock=None,
+        on_event=None,
+    ) -> None:
+        """
+        Args:
+            on_event (callable): called with an event dict on auto mode state
+                changes ({"type": "state", ...}) and recorded tubes
+                ({"type": "record", ...})
+        """
+        super().__init__()
+        self.cfg = cfg
+        self.writer_factory = writer_factory
+        self.on_event = on_event
+        self.last_state = None
+        self.n_logged = 0
+        self.auto = auto
+        self.debug = debug
+        self.job_cache = utils.Job_Cache(cfg, clock=clock)
+        self.tube_cache = None
+        self.roi = None
+        if cfg.main.roi.enable:
+            self.roi = utils.Roi_Tracker(cfg)
+        self.timer = None
+        if cfg.main.profile.enable:
+            self.timer = profiler.Stage_Timer(cfg)
+        self.evidence = None
+        if cfg.main.evidence.enable:
+            self.evidence = evidence.Frame_Ring(cfg)
+        self.last_frame = None
+        self.last_prepared = None
+        self.idle = None
+        self.idle_detector = None
+        self.idle_result = None
+        if cfg.main.idle.enable and auto:
+            self.idle = utils.Idle_Scheduler(cfg)
+            # own buffers for the reduced resolution
+            self.idle_detector = utils.Border_Detector(cfg)
+        self.gate = None
+        if cfg.main.frame_gate.enable:
+            self.gate = utils.Frame_Gate(cfg)
+        self.edge_filter = utils.Edge_Filter(cfg)
+        self.confidence = None
+        self.detector = utils.Border_Detector(
+            cfg, roi=self.roi, timer=self.timer, debug=debug
+        )
+
+    def setup(self, img) -> None:
+        """Creates tube cache and connects to box database with first frame"""
+        cj = self.cfg.job
+        self.tube_cache = tube_data.Tube_Cache(img, self.cfg)
+        self.tube_cache.connect_db(
+            box=cj.box_id,
+            dir=cj.output_dir,
+            async_write=self.cfg.main.database.async_write,
+            writer_factory=self.writer_factory,
+        )
+
+    def prepare(self, frame):
+        """Scales captured frame for display and for border detection
+
+        Job config display_scale / process_scale are relative to the captured
+        frame, if not set, dsize / fx / fy is used for both.
+
+        The same frame object (cached image of use_img mode) is only scaled once.
+
+        Returns:
+            tuple: (img, process_img), process_img is img if scales are equal
+        """
+        if frame is self.last_frame:
+            return self.last_prepared
+        cj = self.cfg.job
+        if cj.display_scale:
+            img = cv2.resize(frame, None, None, cj.display_scale, cj.display_scale)
+        else:
+            img = cv2.resize(frame, cj.dsize, None, cj.fx, cj.fy)
+        process_img = img
+        if cj.process_scale and cj.process_scale != cj.display_scale:
+            process_img = cv2.resize(
+                frame,
+                None,
+                None,
+                cj.process_scale,
+                cj.process_scale,
+                interpolation=cv2.INTER_AREA,
+            )
+        self.last_frame = frame
+        self.last_prepared = (img, process_img)
+        return img, process_img
+
+    def process(self, frame, now=None):
+        """Processes one captured frame
+
+        Args:
+            now (float): frame timestamp in seconds, station clock if not set
+
+        Returns:
+            tuple: (img, border_img, x, record), img is the frame scaled for
+                display, x is in its pixels, record is (status, dy) if a new
+                tube was recorded in auto mode, otherwise None
+        """
+        img, process_img = self.prepare(frame)
+        if self.tube_cache is None:
+            self.setup(img)
+        if self.evidence:
+            self.evidence.push(img)
+        border_img, x = self.detect_frame(img, process_img)
+        if self.timer:
+            t = time.perf_counter()
+        record = self.update(x, now)
+        if self.timer:
+            self.timer.lap("update", t)
+        return img, border_img, x, record
+
+    def detect_frame(self, img, process_img):
+        """Finds tube border, decimated at reduced resolution while WAITing
+
+        A frame in which the coarse detection finds an edge is detected again
+        at full resolution right away.
+
+        Returns:
+            tuple: (border_img, x) in pixels of img
+        """
+        idle = self.idle
+        if idle is None:
+            return self.detect(process_img, img.shape)
+        action = idle.plan(self.job_cache.get_state() == 1)
+        if action == "skip":
+            return self.idle_result
+        t = time.perf_counter()
+        if action == "coarse":
+            coarse_img = cv2.resize(
+                process_img,
+                None,
+                None,
+                idle.scale,
+                idle.scale,
+                interpolation=cv2.INTER_AREA,
+            )
+            self.idle_result = self.idle_detector.detect(coarse_img, img.shape)
+            idle.add_time(action, time.perf_counter() - t)
+            if self.idle_result[1] is None:
+                return self.idle_result
+            logger.debug("Edge found while idle, back to full processing")
+            t = time.perf_counter()
+        result = self.detect(process_img, img.shape)
+        idle.add_time("full", time.perf_counter() - t)
+        return result
+
+    def detect(self, process_img, out_shape=None):
+        """Finds tube border, returns (border_img, x) in display pixels
+
+        With frame gate enabled, result of last detection is reused while
+        frames do not change.
+        """
+        gate = self.gate
+        if gate is None:
+            return self.detector.detect(process_img, out_shape)
+        if self.timer:
+            t = time.perf_counter()
+        result = gate.lookup(process_img)
+        if self.timer:
+            self.timer.lap("gate", t)
+        if result is None:
+            result = self.detector.detect(process_img, out_shape)
+            gate.store(result)
+        return result
+
+    def update(self, x, now=None):
+        """Feeds new border location to state machine and tube cache
+
+        Raw x is smoothed by the edge filter first, its confidence lets the
+        state machine shorten the auto mode delays.
+        """
+        job_cache = self.job_cache
+        tube_cache = self.tube_cache
+        record = None
+        x, self.confidence = self.edge_filter.update(x)
+        job_cache.update(x, tube_cache, self.confidence, now)
+        self.log_transitions()
+        if self.auto:
+            state = job_cache.get_state()
+            logger.debug(f"Current state: {job_cache.get_state_name()} ({state})")
+            if state != self.last_state:
+                self.last_state = state
+                self.emit({"type": "state", "state": job_cache.get_state_name()})
+            if state == 3:
+                tube_cache.update_x(x, job_cache.now)
+            elif state == 5:
+                record = self.record_tube()
+            elif state == 6:
+                tube_cache.reset_x()
+        else:
+            tube_cache.update_x(x, job_cache.now)
+        tube_cache.update_status()
+        return record
+
+    def log_transitions(self, cause="auto", tube_id=-1) -> None:
+        """Writes state transitions since last call to the transitions table
+
+        Transitions of the state machine are only kept in auto mode, those
+        caused by keys in both modes. A key not changing the state is logged
+        as transition to the same state, so every key action is counted. The
+        INITIAL transition is kept in both modes, it marks a session start.
+        """
+        job_cache = self.job_cache
+        transitions = job_cache.transitions[self.n_logged :]
+        self.n_logged = len(job_cache.transitions)
+        if cause == "auto" and not self.auto:
+            transitions = [t for t in transitions if t[1] == 0]
+        if not transitions:
+            if cause == "auto":
+                return
+            now = job_cache.now if job_cache.now is not None else job_cache.clock()
+            transitions = [(now, job_cache.state, job_cache.state, 0)]
+        names = job_cache.state_dict
+        self.tube_cache.write_transitions(
+            [(t, names[old], names[new], period) for t, old, new, period in transitions],
+            cause=cause,
+            tube_id=tube_id,
+        )
+
+    def record_tube(self):
+        """Writes current tube to database, with evidence clip if it FAILs
+
+        Returns:
+            tuple: (status, dy) of the recorded tube
+        """
+        tube_cache = self.tube_cache
+        status, dy = tube_cache.get_tube_data()
+        logger.info(f"New test: status = {status}, dy = {dy * 1000:05f} um")
+        clip = None
+        if status == "FAIL":
+            clip = self.save_clip()
+        self.emit(
+            {
+                "type": "record",
+                "box": tube_cache.box,
+                "tube_id": tube_cache.tube_id,
+                "status": status,
+                "dy": dy,
+                "clip": clip,
+            }
+        )
+        tube_cache.write_db(clip=clip)
+        return status, dy
+
+    def emit(self, event) -> None:
+        if self.on_event:
+            event["time"] = time.time()
+            self.on_event(event)
+
+    def save_clip(self):
+        """Dumps evidence buffer of current tube, returns clip path or None"""
+        if not self.evidence:
+            return None
+        tube_cache = self.tube_cache
+        return self.evidence.dump(f"{tube_cache.box}_{tube_cache.tube_id}")
+
+    def get_overlay_key(self, x):
+        """Returns key of what the monitor overlay shows, changes need a repaint"""
+        tube_cache = self.tube_cache
+        return (
+            None if x is None else int(round(x)),
+            tube_cache.tube_id,
+            tube_cache.max_x,
+            tube_cache.min_x,
+            tube_cache.status,
+            tube_cache.dy,
+            self.job_cache.get_state() if self.auto else None,
+        )
+
+    def render(self, img, border_img):
+        """Returns monitor image: frame with border, limits and auto mode state"""
+        timer = self.timer
+        tube_cache = self.tube_cache
+        if timer:
+            t = time.perf_counter()
+        display_img = cv2.addWeighted(img, 0.8, border_img, 1, 0)
+        if timer:
+            t = timer.lap("blend", t)
+        tube_cache.draw_limits(display_img)
+        if timer:
+            t = timer.lap("limit_img", t)
+        if self.auto:
+            h = tube_cache.r_range
+            display_img = cv2.putText(
+                display_img,
+                f"STATE: {self.job_cache.get_state_name()}",
+                (10, h - 20),
+                cv2.FONT_HERSHEY_COMPLEX_SMALL,
+                1,
+                (0, 255, 255),
+            )
+        return display_img
+
+    def handle_key(self, ky):
+        """Reacts to keyboard inputs
+
+        Returns:
+            str: action name, one of "record", "delete", "reset", "clip", "quit"
+                or None
+        """
+        job_cache = self.job_cache
+        tube_cache = self.tube_cache
+        if ky == ord("\r"):
+            tube_id = tube_cache.tube_id
+            self.record_tube()
+            tube_cache.reset_x()
+            job_cache.set_state(6)
+            self.log_transitions("record", tube_id)
+            return "record"
+        elif ky == ord("d"):
+            logger.info(f"Deleting last entry")
+            tube_cache.delete_db()
+            job_cache.set_state(1)
+            self.log_transitions("delete")
+            return "delete"
+        elif ky == ord("r"):
+            logger.info("Resetting tube data")
+            tube_cache.reset_x()
+            job_cache.set_state(6)
+            self.log_transitions("reset")
+            return "reset"
+        elif ky == ord("c"):
+            self.save_clip()
+            return "clip"
+        elif ky == ord("q"):
+            logger.info("Exiting program ...")
+            job_cache.set_state(0)
+            return "quit"
+        return None
+
+    def close(self) -> None:
+        if self.roi:
+            total = self.roi.roi_frames + self.roi.full_frames
+            logger.info(f"ROI: {self.roi.roi_frames}/{total} frames processed in ROI")
+        if self.idle:
+            idle = self.idle
+            saving = idle.get_saving()
+            logger.info(
+                f"Idle: {idle.n_coarse} coarse, {idle.n_skip} skipped, "
+                f"{idle.n_full} full detections"
+                + (f", {saving:.0%} detection time saved" if saving is not None else "")
+            )
+        if self.gate:
+            total = self.gate.hits + self.gate.misses
+            logger.info(f"Frame gate: {self.gate.hits}/{total} frames reused last result")
+        if self.timer:
+            self.timer.export_summary()
+        if self.evidence:
+            self.evidence.close()
+        if self.tube_cache:
+            self.tube_cache.disconnect_db()
@@ -1,6 +1,9 @@
 import logging
 import pathlib
+import queue
 import sqlite3
+import threading
+import zlib
 from datetime import datetime
 
 import cv2
@@ -12,6 +15,71 @@ SCREEN_SIZE = (95, 95 * 9 / 16)
 AMP = 20
 
 
+class X_Trace(object):
+    """Per-frame border x of one tube in preallocated arrays
+
+    Appends are O(1) amortized, the arrays double in size up to max_samples.
+    When full, every second sample is dropped and only every second
+    following frame is kept, so memory is bounded and the trace still covers
+    the whole tube. max_samples is rounded up to even, so the kept samples
+    stay evenly spaced after decimation.
+    """
+
+    def __init__(self, max_samples=2048, capacity=256) -> None:
+        super().__init__()
+        self.max_samples = max(2, max_samples + max_samples % 2)
+        self.t = np.empty(min(capacity, self.max_samples), dtype=np.float64)
+        self.x = np.empty_like(self.t, dtype=np.float32)
+        self.n = 0
+        self.stride = 1
+        self.count = 0
+        # total appends, changes whenever trace changes
+        self.version = 0
+
+    def append(self, t, x) -> None:
+        self.count += 1
+        if (self.count - 1) % self.stride:
+            return
+        if self.n == len(self.t):
+            if self.n < self.max_samples:
+                size = min(2 * self.n, self.max_samples)
+                self.t = np.resize(self.t, size)
+                self.x = np.resize(self.x, size)
+            else:
+                half = self.n // 2
+                self.t[:half] = self.t[: 2 * half : 2]
+                self.x[:half] = self.x[: 2 * half : 2]
+                self.n = half
+                self.stride *= 2
+        self.t[self.n] = t
+        self.x[self.n] = x
+        self.n += 1
+        self.version += 1
+
+    def get(self):
+        """Returns (t, x) views of the samples"""
+        return self.t[: self.n], self.x[: self.n]
+
+    def reset(self) -> None:
+        self.n = 0
+        self.stride = 1
+        self.count = 0
+        self.version += 1
+
+    def to_blob(self) -> bytes:
+        """Encodes trace as zlib compressed float32 (t - t0, x) pairs
+
+        Decoded by analysis.decode_trace.
+        """
+        t, x = self.get()
+        if not self.n:
+            return None
+        pairs = np.empty((self.n, 2), dtype=np.float32)
+        pairs[:, 0] = t - t[0]
+        pairs[:, 1] = x
+        return zlib.compress(pairs.tobytes())
+
+
 class Tube_Cache(object):
     def __init__(self, base_img, cfg) -> None:
         super().__init__()
@@ -35,8 +103,29 @@ class Tube_Cache(object):
         self.dy = 0
         self.box = cfg.job.box_id
         self.tube_id = -1
+        self.writer = None
+        # per-frame x trace, dy from its percentiles if percentile is set
+        ct = cm.trace
+        self.trace = None
+        self.percentile = None
+        if ct and ct.enable:
+            self.trace = X_Trace(ct.max_samples or 2048)
+            self.percentile = ct.percentile
+        self.robust_key = None
+        self.robust_limits = None
+        # overlay cache
+        self.overlay_key = None
+        self.overlay_img = None
+        self.overlay_mask = None
 
-    def update_x(self, x):
+    def update_x(self, x, now=None):
+        """Updates limits with new border location
+
+        Args:
+            now (float): timestamp of x in seconds, for the x trace
+        """
+        if x and self.trace is not None and now is not None:
+            self.trace.append(now, x)
         if x and x > self.max_x:
             self.max_x = x
         if x and x < self.min_x:
@@ -50,8 +139,60 @@ class Tube_Cache(object):
         self.range_x = float("inf")
         self.status = "Unknown"
         self.dy = 0
+        if self.trace is not None:
+            self.trace.reset()
+
+    def get_limits(self):
+        """Returns (low, up) border x used for dy
+
+        Raw extremes, or percentiles of the x trace if configured, so a single
+        outlier frame does not set dy.
+        """
+        if self.percentile is None or self.trace.n < 2:
+            return self.min_x, self.max_x
+        if self.robust_key != self.trace.version:
+            _, x = self.trace.get()
+            low, up = np.percentile(x, [self.percentile, 100 - self.percentile])
+            self.robust_limits = (float(low), float(up))
+            self.robust_key = self.trace.version
+        return self.robust_limits
 
     def get_limit_img(self, color_l=(255, 0, 0), color_a=(0, 255, 0), thickness=2):
+        """Returns overlay image of meta info and limits
+
+        The overlay is cached and only re-rendered when its inputs change, the
+        returned image is shared between calls and must not be modified.
+        """
+        self.update_status()
+        key = (
+            self.box,
+            self.tube_id,
+            self.max_x,
+            self.min_x,
+            self.status,
+            self.dy,
+            color_l,
+            color_a,
+            thickness,
+        )
+        if key != self.overlay_key:
+            self.overlay_key = key
+            self.overlay_img = self.render_limit_img(color_l, color_a, thickness)
+            self.overlay_mask = np.any(self.overlay_img, axis=2).astype(np.uint8)
+            logger.debug("Overlay re-rendered")
+        return self.overlay_img
+
+    def draw_limits(self, img, **kwargs):
+        """Adds overlay onto img in place, only pixels covered by overlay are touched
+
+        Same result as cv2.addWeighted(img, 1, limit_img, 1, 0) without
+        allocating a new full frame.
+        """
+        limit_img = self.get_limit_img(**kwargs)
+        cv2.add(img, limit_img, dst=img, mask=self.overlay_mask)
+        return img
+
+    def render_limit_img(self, color_l=(255, 0, 0), color_a=(0, 255, 0), thickness=2):
         img = np.copy(self.base_img)
         # draw meta info
         img = cv2.putText(
@@ -73,72 +214,85 @@ class Tube_Cache(object):
         )
         # draw upper limit
         if 0 <= self.max_x < self.c_range:
+            max_x = int(round(self.max_x))  # x may have sub-pixel precision
             img = cv2.line(
                 img,
-                (self.max_x, 0),
-                (self.max_x, self.r_range - 1),
+                (max_x, 0),
+                (max_x, self.r_range - 1),
                 color_l,
                 thickness=thickness,
             )
             dist = (self.c_range - self.max_x) * self.unit_x
-            mid_x = (self.max_x + self.c_range) // 2
+            mid_x = (max_x + self.c_range) // 2
             p1 = (self.c_range - 1, self.max_y)
-            p2 = (self.max_x, self.max_y)
+            p2 = (max_x, self.max_y)
             org = (mid_x - 40, self.max_y - 15)
             img = plot_arrow(img, p1, p2, dist, org, color_a)
         # draw lower limit
         if 0 <= self.min_x < self.c_range:
+            min_x = int(round(self.min_x))
             img = cv2.line(
                 img,
-                (self.min_x, 0),
-                (self.min_x, self.r_range - 1),
+                (min_x, 0),
+                (min_x, self.r_range - 1),
                 color_l,
                 thickness=thickness,
             )
             dist = self.min_x * self.unit_x
-            mid_x = self.min_x // 2
+            mid_x = min_x // 2
             p1 = (0, self.min_y)
-            p2 = (self.min_x, self.min_y)
+            p2 = (min_x, self.min_y)
             org = (mid_x - 40, self.min_y - 15)
             img = plot_arrow(img, p1, p2, dist, org, color_a)
         # draw range
         if 0 <= self.max_x < self.c_range and 0 <= self.min_x < self.c_range:
             dist = self.range_x * self.unit_x
-            mid_x = (self.max_x + self.min_x) // 2
-            p1 = (self.min_x, self.mid_y)
-            p2 = (self.max_x, self.mid_y)
+            mid_x = (max_x + min_x) // 2
+            p1 = (min_x, self.mid_y)
+            p2 = (max_x, self.mid_y)
             org = (mid_x - 40, self.mid_y - 15)
             img = plot_arrow(img, p1, p2, dist, org, color_a)
             org = (mid_x - 65, self.mid_y + 20)
-            dy = dist / 2
+            self.update_status()
             img = cv2.putText(
                 img,
-                f"dy = {dy:.02f} mm",
+                f"dy = {self.dy:.02f} mm",
                 org,
                 cv2.FONT_HERSHEY_COMPLEX_SMALL,
                 1,
                 color_a,
             )
-            # set status
-            status = "PASS"
+            # draw status
             color_s = (0, 255, 0)
-            if dy > self.threshold:
-                status = "FAIL"
+            if self.status == "FAIL":
                 color_s = (0, 0, 255)
             org = (self.c_range // 2 - 80, self.r_range - 20)
             img = cv2.putText(
-                img, status, org, cv2.FONT_HERSHEY_COMPLEX_SMALL, 3, color_s,
+                img, self.status, org, cv2.FONT_HERSHEY_COMPLEX_SMALL, 3, color_s,
             )
+        return img
 
-            # update tube measurement
+    def update_status(self):
+        """Updates tube measurement (status & dy) from current limits"""
+        if 0 <= self.max_x < self.c_range and 0 <= self.min_x < self.c_range:
+            low, up = self.get_limits()
+            dy = (up - low) * self.unit_x / 2
+            status = "PASS"
+            if dy > self.threshold:
+                status = "FAIL"
             self.status = status
             self.dy = dy
-        return img
 
     def get_tube_data(self):
         return self.status, self.dy
 
-    def connect_db(self, dir="run", box="Unknown"):
+    def connect_db(self, dir="run", box="Unknown", async_write=True, writer_factory=None):
+        """Connects to box database
+
+        Args:
+            writer_factory (callable): creates writer for given db path, a
+                local Db_Writer is used if not set
+        """
         # create directory
         db_dir = pathlib.Path(dir)
         db_dir.mkdir(parents=True, exist_ok=True)
@@ -146,32 +300,61 @@ class Tube_Cache(object):
         self.box = box
         db_path = db_dir / f"{box}.db"
         logger.info(f"Connecting to {db_path}")
-        self.con = sqlite3.connect(db_path)
-        self.cur = self.con.cursor()
+        if writer_factory is None:
+            self.writer = Db_Writer(db_path, async_write=async_write)
+        else:
+            self.writer = writer_factory(db_path)
         # create [tubes] table if not exists
-        self.cur.execute(
-            """CREATE TABLE IF NOT EXISTS tubes(box, date, time, operator, tube_id, status, up_pix, low_pix, dy, threshold, unit_x)"""
+        self.writer.execute(
+            """CREATE TABLE IF NOT EXISTS tubes(box, date, time, operator, tube_id, status, up_pix, low_pix, dy, threshold, unit_x, clip, trace BLOB)"""
         )
+        self.writer.execute(
+            "CREATE INDEX IF NOT EXISTS idx_tubes_tube_id ON tubes(tube_id)"
+        )
+        # auto mode state transitions, period is the time spent in from_state
+        self.writer.execute(
+            """CREATE TABLE IF NOT EXISTS transitions(box, tube_id, time, from_state, to_state, period, cause)"""
+        )
+        # databases of older versions have no clip / trace column
+        columns = self.writer.query("SELECT name FROM pragma_table_info('tubes')")
+        if "clip" not in columns:
+            self.writer.execute("ALTER TABLE tubes ADD COLUMN clip")
+        if "trace" not in columns:
+            self.writer.execute("ALTER TABLE tubes ADD COLUMN trace BLOB")
+        self.writer.flush()
+        # track existing tube ids in memory, no more MAX() query per record
+        self.tube_ids = set(self.writer.query("SELECT DISTINCT tube_id FROM tubes"))
         self.update_tube_id()
 
     def disconnect_db(self):
-        self.con.close()
+        """Flushes pending writes and closes database"""
+        self.writer.close()
 
     def update_tube_id(self):
-        if not self.cur:
+        if self.writer is None:
             self.tube_id = -1
         else:
-            max_id = self.cur.execute("SELECT MAX(tube_id) FROM tubes").fetchall()
-            max_id = max_id[0][0]
-            if max_id is None:
-                max_id = 0
+            ids = [i for i in self.tube_ids if i is not None]
+            max_id = max(ids) if ids else 0
             self.tube_id = max_id + 1
 
-    def write_db(self, tube_id=-1):
+    def write_db(self, tube_id=-1, clip=None):
+        """Records current tube
+
+        up_pix / low_pix are the limits dy is computed from, the x trace is
+        saved as blob (see X_Trace.to_blob) if enabled.
+
+        Args:
+            clip (str): path of evidence clip of the tube, if any
+        """
         dt_string = datetime.today().strftime("%Y/%m/%d")
         time_string = datetime.now().strftime("%H:%M:%S")
         if tube_id == -1:
             tube_id = self.tube_id
+        low, up = self.get_limits()
+        trace = None
+        if self.trace is not None:
+            trace = self.trace.to_blob()
         values = (
             self.box,
             dt_string,
@@ -179,28 +362,242 @@ class Tube_Cache(object):
             " & ".join(self.operator),
             tube_id,
             self.status,
-            self.max_x,
-            self.min_x,
+            up,
+            low,
             self.dy,
             self.threshold,
             self.unit_x,
+            clip,
+            trace,
         )
         logger.debug(f"Inserting values ...")
-        self.cur.execute(
-            "INSERT INTO tubes (box, date, time, operator, tube_id, status, up_pix, low_pix, dy, threshold, unit_x) Values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        self.writer.execute(
+            "INSERT INTO tubes (box, date, time, operator, tube_id, status, up_pix, low_pix, dy, threshold, unit_x, clip, trace) Values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
             values,
         )
-        self.con.commit()
+        self.tube_ids.add(tube_id)
         self.update_tube_id()
 
-    def delete_db(self):
-        self.cur.execute(
-            "DELETE FROM tubes WHERE tube_id = (SELECT MAX(tube_id) FROM tubes)"
+    def write_transitions(self, transitions, cause="auto", tube_id=-1):
+        """Records state transitions in one batch
+
+        Args:
+            transitions (list): (time, from_state, to_state, period) tuples,
+                time is unix time in seconds, states are state names
+            cause (str): "auto" for state machine, otherwise key action name
+        """
+        if tube_id == -1:
+            tube_id = self.tube_id
+        self.writer.executemany(
+            "INSERT INTO transitions (box, tube_id, time, from_state, to_state, period, cause) Values (?, ?, ?, ?, ?, ?, ?)",
+            [(self.box, tube_id) + tuple(t) + (cause,) for t in transitions],
         )
-        self.con.commit()
+
+    def delete_db(self):
+        # delete entries with max tube id
+        if self.tube_ids:
+            max_id = self.tube_id - 1
+            self.writer.execute("DELETE FROM tubes WHERE tube_id = ?", (max_id,))
+            self.tube_ids.discard(max_id)
         self.update_tube_id()
 
 
+class Db_Writer(object):
+    """SQLite writer executing statements on a background thread
+
+    Statements are queued and committed in batches, so a slow disk never blocks
+    the caller. The database is switched to WAL journal mode so that readers
+    (e.g. reporting tools) do not block the writer.
+
+    Args:
+        db_path (str): database path
+        async_write (bool): if False, statements are executed and committed
+            immediately in the calling thread
+        batch_size (int): max number of statements per commit
+    """
+
+    def __init__(self, db_path, async_write=True, batch_size=64) -> None:
+        super().__init__()
+        self.db_path = db_path
+        self.async_write = async_write
+        self.batch_size = batch_size
+        self.con = open_db(db_path)
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+        if async_write:
+            self._thread = threading.Thread(
+                target=self._run, name="db_writer", daemon=True
+            )
+            self._thread.start()
+
+    def execute(self, sql, params=()) -> None:
+        if self.async_write:
+            self._queue.put((sql, params))
+        else:
+            with self._lock:
+                self.con.execute(sql, params)
+                self.con.commit()
+
+    def executemany(self, sql, seq_of_params) -> None:
+        seq_of_params = list(seq_of_params)
+        if self.async_write:
+            self._queue.put((sql, seq_of_params, True))
+        else:
+            with self._lock:
+                self.con.executemany(sql, seq_of_params)
+                self.con.commit()
+
+    def query(self, sql, params=()) -> list:
+        """Runs a read query after all pending writes, returns first column"""
+        self.flush()
+        with self._lock:
+            return [row[0] for row in self.con.execute(sql, params).fetchall()]
+
+    def flush(self) -> None:
+        """Blocks until all queued statements are committed"""
+        if self.async_write:
+            self._queue.join()
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            self.con.close()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            # drain whatever is pending to commit it in one transaction
+            while item is not None and len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+            stop = batch[-1] is None
+            statements = [b for b in batch if b is not None]
+            try:
+                with self._lock:
+                    for statement in statements:
+                        if len(statement) == 3:
+                            self.con.executemany(statement[0], statement[1])
+                        else:
+                            self.con.execute(*statement)
+                    self.con.commit()
+                logger.debug(f"Committed {len(statements)} statements")
+            except Exception:
+                logger.exception(f"Failed to write to {self.db_path}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                break
+
+
+class Remote_Db_Writer(object):
+    """Db_Writer counterpart sending statements to a coordinating writer process
+
+    Used by multi-station mode, where all box databases are written by a
+    single process running run_db_coordinator(). Reads are done locally with
+    a read-only connection after pending writes are flushed.
+
+    Args:
+        request_queue (multiprocessing.Queue): queue to the coordinator
+        reply_queue (multiprocessing.Queue): queue for flush acknowledgements
+        client_id (int): index of reply_queue in coordinator
+    """
+
+    def __init__(self, db_path, request_queue, reply_queue, client_id) -> None:
+        super().__init__()
+        self.db_path = str(db_path)
+        self.request_queue = request_queue
+        self.reply_queue = reply_queue
+        self.client_id = client_id
+
+    def execute(self, sql, params=()) -> None:
+        self.request_queue.put(("execute", self.db_path, sql, tuple(params)))
+
+    def executemany(self, sql, seq_of_params) -> None:
+        self.request_queue.put(("executemany", self.db_path, sql, list(seq_of_params)))
+
+    def query(self, sql, params=()) -> list:
+        self.flush()
+        con = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        try:
+            return [row[0] for row in con.execute(sql, params).fetchall()]
+        finally:
+            con.close()
+
+    def flush(self) -> None:
+        self.request_queue.put(("flush", self.db_path, self.client_id, None))
+        self.reply_queue.get()
+
+    def close(self) -> None:
+        self.request_queue.put(("close", self.db_path, self.client_id, None))
+        self.reply_queue.get()
+
+
+def run_db_coordinator(request_queue, reply_queues, batch_size=64):
+    """Writes all box databases of a multi-station run, run in its own process
+
+    Requests are (command, db_path, sql / client_id, params), see
+    Remote_Db_Writer. A None request stops the coordinator.
+    """
+    connections = {}
+    running = True
+    while running:
+        batch = [request_queue.get()]
+        while batch[-1] is not None and len(batch) < batch_size:
+            try:
+                batch.append(request_queue.get_nowait())
+            except queue.Empty:
+                break
+        # execute writes, then commit each touched database once
+        dirty = set()
+        replies = []
+        for request in batch:
+            if request is None:
+                running = False
+                break
+            command, db_path, arg, params = request
+            if db_path not in connections:
+                connections[db_path] = open_db(db_path)
+            con = connections[db_path]
+            try:
+                if command == "execute":
+                    con.execute(arg, params)
+                    dirty.add(db_path)
+                elif command == "executemany":
+                    con.executemany(arg, params)
+                    dirty.add(db_path)
+                elif command in ("flush", "close"):
+                    replies.append((command, db_path, arg))
+            except Exception:
+                logger.exception(f"Failed to write to {db_path}")
+        for db_path in dirty:
+            connections[db_path].commit()
+        for command, db_path, client_id in replies:
+            if command == "close":
+                connections.pop(db_path).close()
+            reply_queues[client_id].put(True)
+    for con in connections.values():
+        con.commit()
+        con.close()
+
+
+def open_db(db_path):
+    """Opens box database in WAL mode, usable from any thread"""
+    con = sqlite3.connect(db_path, check_same_thread=False)
+    con.execute("PRAGMA journal_mode=WAL")
+    # with WAL, NORMAL only risks the last commits on power loss, not corruption
+    con.execute("PRAGMA synchronous=NORMAL")
+    return con
+
+
 def plot_arrow(img, p1, p2, dist, org, color, thickness=1):
     img = cv2.arrowedLine(
         img, p1, p2, color, thickness=thickness, line_type=8, shift=0, tipLength=0.05,
@@ -0,0 +1,200 @@
+import argparse
+import concurrent.futures
+import itertools
+import logging
+import os
+import pathlib
+import random
+import time
+
+import cv2
+import numpy as np
+import yaml
+
+import config
+import utils
+
+logging_format = "%(asctime)s,%(msecs)03d - %(levelname)s - %(message)s"
+logger = logging.getLogger("bend_tester")
+
+# frames shared by all evaluations of a worker process
+_frames = []
+_main_dict = {}
+
+
+def to_nested(params) -> dict:
+    """Converts {"canny.threshold1": 100} to {"canny": {"threshold1": 100}}"""
+    nested = {}
+    for key, value in params.items():
+        node = nested
+        parts = key.split(".")
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return nested
+
+
+def init_worker(frames, main_dict):
+    global _frames, _main_dict
+    _frames = frames
+    _main_dict = main_dict
+    # one OpenCV thread per worker, the pool already uses all cores
+    cv2.setNumThreads(1)
+
+
+def evaluate(params) -> dict:
+    """Runs border detection with params over all frames
+
+    Returns:
+        dict: params, detected x of each frame (nan if none) and cost in ms/frame
+    """
+    cfg = config.Config({"main": _main_dict})
+    cfg.main.update(to_nested(params))
+    detector = utils.Border_Detector(cfg, n_outputs=1)
+    xs = np.full(len(_frames), np.nan)
+    start_time = time.perf_counter()
+    for i, img in enumerate(_frames):
+        _, x = detector.detect(img)
+        if x is not None:
+            xs[i] = x
+    cost = (time.perf_counter() - start_time) / len(_frames) * 1000
+    return {"params": params, "xs": xs, "cost": cost}
+
+
+def score(result, ref_found) -> dict:
+    """Scores detection stability of one evaluation
+
+    jitter: std of frame-to-frame change of x over consecutive detections
+    miss_rate: fraction of frames with border (by reference config) not detected
+    false_rate: fraction of frames without border (by reference config) in
+        which a border is detected
+    """
+    xs = result["xs"]
+    found = ~np.isnan(xs)
+    both = found[1:] & found[:-1]
+    dx = np.diff(xs)[both]
+    jitter = float(np.std(dx)) if dx.size else float("inf")
+    n_ref = max(1, np.count_nonzero(ref_found))
+    miss_rate = float(np.count_nonzero(ref_found & ~found) / n_ref)
+    n_empty = max(1, np.count_nonzero(~ref_found))
+    false_rate = float(np.count_nonzero(~ref_found & found) / n_empty)
+    return {
+        "jitter": jitter,
+        "miss_rate": miss_rate,
+        "false_rate": false_rate,
+        "cost": result["cost"],
+    }
+
+
+def pareto_front(scores) -> list:
+    """Returns indices of scores not dominated in (jitter, miss_rate, false_rate, cost)"""
+    keys = ("jitter", "miss_rate", "false_rate", "cost")
+    values = np.array([[s[k] for k in keys] for s in scores])
+    front = []
+    for i, v in enumerate(values):
+        dominated = np.any(np.all(values <= v, axis=1) & np.any(values < v, axis=1))
+        if not dominated:
+            front.append(i)
+    return front
+
+
+def read_frames(job_yaml, max_frames) -> list:
+    cfg = config.Config({})
+    cfg.update(config.load_yaml_dict(yaml_path=job_yaml))
+    cj = cfg.job
+    frames = []
+    if cj.use_img:
+        img = cv2.imread(cj.img_path)
+        if img is not None:
+            frames.append(cv2.resize(img, cj.dsize, None, cj.fx, cj.fy))
+        return frames
+    cap = cv2.VideoCapture(cj.video_path)
+    while len(frames) < max_frames:
+        success, img = cap.read()
+        if not success:
+            break
+        frames.append(cv2.resize(img, cj.dsize, None, cj.fx, cj.fy))
+    cap.release()
+    return frames
+
+
+def main():
+    # Parse arguments
+    parser = argparse.ArgumentParser(
+        description="Scan edge detection parameters over recorded videos in parallel"
+    )
+    parser.add_argument("tune_config", action="store", help="scan config yaml")
+    parser.add_argument("job_configs", nargs="+", help="job yaml(s) of recorded videos")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="processes")
+    parser.add_argument(
+        "-o", "--output-dir", default="tune_output", help="directory for yaml fragments"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(format=logging_format, datefmt="%Y-%m-%d:%H:%M:%S")
+    logger.setLevel(logging.INFO)
+
+    # Load configs
+    main_dict = config.load_yaml_dict(yaml_path="share/main/main.yaml")["main"]
+    tune_cfg = config.load_yaml_dict(yaml_path=args.tune_config)
+    space = tune_cfg["space"]
+    names = list(space.keys())
+    if tune_cfg.get("search", "grid") == "random":
+        rng = random.Random(tune_cfg.get("seed", 0))
+        samples = {
+            tuple(rng.choice(space[name]) for name in names)
+            for _ in range(tune_cfg.get("samples", 50))
+        }
+        candidates = [dict(zip(names, values)) for values in sorted(samples, key=str)]
+    else:
+        candidates = [
+            dict(zip(names, values))
+            for values in itertools.product(*(space[name] for name in names))
+        ]
+    # reference run with current config, defines frames expected to have a border
+    candidates.insert(0, {})
+    frames = []
+    for job_yaml in args.job_configs:
+        frames += read_frames(job_yaml, tune_cfg.get("max_frames", 200))
+    if not frames:
+        logger.critical("no video captured")
+        exit()
+    logger.info(f"Scanning {len(candidates) - 1} settings over {len(frames)} frames")
+
+    # Evaluate in process pool
+    start_time = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=args.workers or os.cpu_count(),
+        initializer=init_worker,
+        initargs=(frames, main_dict),
+    ) as executor:
+        results = list(executor.map(evaluate, candidates, chunksize=1))
+    logger.info(f"Scan finished in {time.perf_counter() - start_time:.1f} s")
+    ref_found = ~np.isnan(results[0]["xs"])
+    scores = [score(r, ref_found) for r in results]
+
+    # Report Pareto-best settings
+    out_dir = pathlib.Path(args.output_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    front = sorted(pareto_front(scores), key=lambda i: scores[i]["jitter"])
+    print("")
+    print(f"{'#':>4}{'jitter px':>11}{'miss':>8}{'false':>8}{'ms/frame':>10}  params")
+    for rank, i in enumerate(front):
+        s = scores[i]
+        params = results[i]["params"]
+        label = "current config" if i == 0 else params
+        print(
+            f"{rank:>4}{s['jitter']:>11.3f}{s['miss_rate']:>8.1%}"
+            f"{s['false_rate']:>8.1%}{s['cost']:>10.2f}  {label}"
+        )
+        fragment = {"main": to_nested(params)}
+        with open(out_dir / f"pareto_{rank:02d}.yaml", "w") as f:
+            f.write(
+                f"# jitter = {s['jitter']:.3f} px, miss rate = {s['miss_rate']:.3f}, "
+                f"false rate = {s['false_rate']:.3f}, cost = {s['cost']:.2f} ms/frame\n"
+            )
+            yaml.safe_dump(fragment, f, default_flow_style=False)
+    logger.info(f"Pareto-best configurations saved to {out_dir}/pareto_*.yaml")
+
+
+if __name__ == "__main__":
+    main()
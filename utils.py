@@ -1,38 +1,90 @@
-import os
-
-os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "hide"
-
 import logging
+import os
+import queue
+import threading
 import time
 
 import cv2
 import numpy as np
-from pygame import mixer
 
-mixer.init()
 logger = logging.getLogger()
 
 
 class Test_Sound(object):
-    def __init__(self) -> None:
+    """Sound feedback played by a background thread
+
+    pygame is imported and the sounds are decoded by that thread, so startup
+    does not wait for audio and tools not playing sounds never load it. If
+    audio is disabled or not available, sounds are silently dropped.
+    """
+
+    sound_files = {
+        "add": "res/add.mp3",
+        "remove": "res/remove.mp3",
+        "error": "res/error.mp3",
+    }
+
+    def __init__(self, enable=True) -> None:
         super().__init__()
-        self.add_sound = mixer.Sound("res/add.mp3")
-        self.remove_sound = mixer.Sound("res/remove.mp3")
-        self.error_sound = mixer.Sound("res/error.mp3")
+        self.requests = queue.Queue()
+        self.thread = None
+        if enable:
+            self.thread = threading.Thread(
+                target=self.run, name="test_sound", daemon=True
+            )
+            self.thread.start()
+
+    def run(self) -> None:
+        try:
+            os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "hide"
+            from pygame import mixer
+
+            mixer.init()
+            sounds = {
+                name: mixer.Sound(path) for name, path in self.sound_files.items()
+            }
+        except Exception as e:
+            logger.warning(f"Audio not available, sound feedback disabled: {e}")
+            return
+        while True:
+            name = self.requests.get()
+            if name is None:
+                break
+            sounds[name].play()
+
+    def play(self, name) -> None:
+        if self.thread is not None and self.thread.is_alive():
+            self.requests.put(name)
 
     def add(self):
-        self.add_sound.play()
+        self.play("add")
 
     def remove(self):
-        self.remove_sound.play()
+        self.play("remove")
 
     def error(self):
-        self.error_sound.play()
+        self.play("error")
+
+    def close(self) -> None:
+        if self.thread is not None and self.thread.is_alive():
+            self.requests.put(None)
+            self.thread.join(timeout=1)
+
+
+def open_capture(cj):
+    """Opens configured video source of job config, returns cv2.VideoCapture"""
+    if cj.webcam:
+        return cv2.VideoCapture(cj.webcam_id)
+    return cv2.VideoCapture(cj.video_path)
 
 
 class Job_Cache(object):
-    def __init__(self, cfg) -> None:
+    def __init__(self, cfg, clock=None) -> None:
         """
+        Args:
+            clock (callable): returns current time in seconds, time.time if not
+                set, replays may instead pass per-frame timestamps to update
+
         Status Code:
             0: Initial
             1: Wait
@@ -45,15 +97,24 @@ class Job_Cache(object):
         """
         super().__init__()
         # data
+        self.clock = clock or time.time
+        self.now = None
         self.state = 0
-        self.time_stamp = time.time()
+        self.time_stamp = None
         self.edge = None
+        # state transitions: (time, old state, new state, period in old state)
+        self.transitions = []
+        self.state_times = {}
         # settings
         cm = cfg.main
         self.test_delay = cm.test_delay
         self.stable_period = cm.stable_period
         self.rapid_change_reject = cm.rapid_change_reject
         self.record_delay = cm.record_delay
+        # fast transitions when edge filter is confident, disabled if threshold is None
+        self.confidence_threshold = cm.confidence_threshold
+        self.fast_test_delay = cm.fast_test_delay
+        self.fast_record_delay = cm.fast_record_delay
         self.state_dict = {
             0: "INITIAL",
             1: "WAIT",
@@ -71,12 +132,56 @@ class Job_Cache(object):
         return self.state_dict[self.state]
 
     def set_state(self, value) -> None:
+        if value != self.state:
+            self.enter_state(value, self.now if self.now is not None else self.clock())
+
+    def enter_state(self, value, now) -> None:
+        period = 0
+        if self.time_stamp is not None:
+            period = now - self.time_stamp
+            name = self.state_dict[self.state]
+            self.state_times[name] = self.state_times.get(name, 0) + period
+        self.transitions.append((now, self.state, value, period))
         self.state = value
+        self.time_stamp = now
 
     def get_period(self) -> float:
-        return time.time() - self.time_stamp
+        return self.now - self.time_stamp
+
+    def get_state_times(self) -> dict:
+        """Returns total seconds spent in each state, current state included"""
+        state_times = dict(self.state_times)
+        if self.time_stamp is not None:
+            name = self.state_dict[self.state]
+            state_times[name] = state_times.get(name, 0) + self.now - self.time_stamp
+        return state_times
+
+    def export_trace(self, path) -> None:
+        """Saves state transitions to csv"""
+        with open(path, "w") as f:
+            f.write("time,from,to,period\n")
+            for now, old, new, period in self.transitions:
+                f.write(
+                    f"{now:.3f},{self.state_dict[old]},{self.state_dict[new]},{period:.3f}\n"
+                )
+
+    def is_confident(self, confidence, delay) -> bool:
+        """Checks whether confidence allows to leave current state after delay"""
+        if self.confidence_threshold is None or confidence is None:
+            return False
+        return confidence >= self.confidence_threshold and self.get_period() >= delay
+
+    def update(self, edge, tube_cache, confidence=None, now=None) -> int:
+        """Updates state with new border location
 
-    def update(self, edge, tube_cache) -> int:
+        Args:
+            confidence (float): confidence of Edge_Filter that edge presence
+                (or absence) is stable, enables shorter test/record delays
+            now (float): frame timestamp in seconds, clock is used if not set
+        """
+        self.now = self.clock() if now is None else now
+        if self.time_stamp is None:
+            self.time_stamp = self.now
         self.edge = edge
         state = -1
         # Initial
@@ -93,6 +198,8 @@ class Job_Cache(object):
             if edge:
                 if self.get_period() >= self.test_delay:
                     state = 3
+                elif self.is_confident(confidence, self.fast_test_delay):
+                    state = 3
                 else:
                     state = 2
             else:
@@ -120,6 +227,8 @@ class Job_Cache(object):
             else:
                 if self.get_period() >= self.record_delay:
                     state = 5
+                elif self.is_confident(confidence, self.fast_record_delay):
+                    state = 5
                 else:
                     state = 4
         # Record
@@ -132,50 +241,527 @@ class Job_Cache(object):
         else:
             logger.error("Unknown status code:", self.state)
         if state != self.state:
-            self.state = state
-            self.time_stamp = time.time()
+            self.enter_state(state, self.now)
         return state
 
 
-def get_border(img, cfg, debug=False):
-    cm = cfg.main
+class Display_Limiter(object):
+    """Decides when the monitor is repainted, independent of processing rate
+
+    Repaints are limited to display fps, with on_change only frames whose
+    overlay key (border, limits, state...) changed are shown, plus one every
+    idle_period so the live image does not freeze.
+    """
+
+    def __init__(self, cfg) -> None:
+        super().__init__()
+        cd = cfg.main.display
+        self.min_period = 1 / cd.fps if cd.fps else 0
+        self.on_change = cd.on_change
+        self.idle_period = cd.idle_period or 1.0
+        self.t_last = -float("inf")
+        self.last_key = None
+        self.painted = 0
+        self.skipped = 0
+
+    def is_due(self, key=None) -> bool:
+        now = time.perf_counter()
+        period = now - self.t_last
+        due = period >= self.min_period
+        if due and self.on_change:
+            due = key != self.last_key or period >= self.idle_period
+        if due:
+            self.t_last = now
+            self.last_key = key
+            self.painted += 1
+        else:
+            self.skipped += 1
+        return due
+
+
+class Edge_Filter(object):
+    """Temporal filter of border location between detector and tube cache
+
+    Methods:
+        none: raw x is passed through
+        median: sliding median over last frames
+        ema: exponential moving average
+        kalman: 1-D Kalman filter with constant position model
+
+    Besides filtered x, a per-frame confidence (0 ~ 1) is given telling how
+    stable the current edge presence is: fraction of recent frames agreeing
+    on presence, reduced by the spread of recent x when edge is present.
+    """
+
+    def __init__(self, cfg) -> None:
+        super().__init__()
+        cf = cfg.main.edge_filter
+        self.method = cf.method or "none"
+        if self.method not in ("none", "median", "ema", "kalman"):
+            logger.critical(f"Unknown edge filter method: {self.method}")
+            raise ValueError
+        self.window = cf.window or 5
+        self.alpha = cf.alpha
+        self.process_noise = cf.process_noise
+        self.measurement_noise = cf.measurement_noise
+        self.spread_tol = cf.spread_tol
+        self.max_missing = cf.max_missing
+        # recent raw x, nan for missing
+        self.history = np.full(self.window, np.nan)
+        self.n_seen = 0
+        self.reset()
+
+    def reset(self) -> None:
+        """Forgets the last edge, x of a previous tube must not leak into the next"""
+        self.x = None
+        self.p = 0.0
+        self.missing = 0
+        # nan counts as missing, so confidence in absence is kept
+        self.history.fill(np.nan)
+
+    def update(self, x):
+        """Feeds raw x of a new frame
+
+        Returns:
+            tuple: (x_filtered, confidence), x_filtered is None if no edge
+        """
+        self.history[self.n_seen % self.window] = np.nan if x is None else x
+        self.n_seen += 1
+        confidence = self.get_confidence(x is not None)
+        if x is None:
+            self.missing += 1
+            if self.missing >= self.max_missing:
+                self.reset()
+            return None, confidence
+        self.missing = 0
+        if self.method == "none" or self.x is None:
+            self.x = float(x)
+            self.p = self.measurement_noise or 1.0
+        elif self.method == "median":
+            self.x = float(np.nanmedian(self.history))
+        elif self.method == "ema":
+            self.x += self.alpha * (x - self.x)
+        elif self.method == "kalman":
+            self.p += self.process_noise
+            gain = self.p / (self.p + self.measurement_noise)
+            self.x += gain * (x - self.x)
+            self.p *= 1 - gain
+        if self.method == "none":
+            return x, confidence
+        return self.x, confidence
+
+    def get_confidence(self, present) -> float:
+        n = min(self.n_seen, self.window)
+        recent = self.history[:n]
+        found = ~np.isnan(recent)
+        agree = np.count_nonzero(found == present) / self.window
+        if not present:
+            return float(agree)
+        spread = np.ptp(recent[found])
+        return float(agree * max(0.0, 1 - spread / self.spread_tol))
+
+
+class Roi_Tracker(object):
+    """Tracks border location to restrict detection to a column band
+
+    The band is centered at the last detected x, detection falls back to the
+    full frame when nothing is found or too few lines support the result.
+    """
+
+    def __init__(self, cfg) -> None:
+        super().__init__()
+        cr = cfg.main.roi
+        self.half_width = cr.half_width
+        self.min_lines = cr.min_lines
+        self.set_pixel_scale(1.0)
+        self.x = None
+        # counters
+        self.roi_frames = 0
+        self.full_frames = 0
+
+    def get_band(self, width):
+        """Returns column range (x0, x1) to process for a frame of given width"""
+        if self.x is None:
+            self.full_frames += 1
+            return 0, width
+        self.roi_frames += 1
+        x = int(self.x)
+        x0 = max(0, x - self.band_half_width)
+        x1 = min(width, x + self.band_half_width + 1)
+        return x0, x1
+
+    def set_pixel_scale(self, scale) -> None:
+        """Scales half width (display pixels) by processed / display frame width"""
+        self.band_half_width = max(1, int(round(self.half_width * scale)))
+
+    def update(self, x, n_lines) -> None:
+        if x is None or n_lines < self.min_lines:
+            if self.x is not None:
+                logger.debug("ROI lost, widening to full frame")
+            self.x = None
+        else:
+            self.x = x
+
+    def reset(self) -> None:
+        self.x = None
+
+
+class Idle_Scheduler(object):
+    """Plans decimated, coarse border detection while waiting for a tube
+
+    Also accounts detection time to estimate the saving against detecting
+    every frame at full resolution.
+    """
+
+    def __init__(self, cfg) -> None:
+        super().__init__()
+        ci = cfg.main.idle
+        self.interval = max(1, ci.interval or 1)
+        self.scale = ci.scale or 1.0
+        self.count = 0
+        # counters
+        self.n_frames = 0
+        self.n_full = 0
+        self.n_coarse = 0
+        self.n_skip = 0
+        self.t_full = 0
+        self.t_coarse = 0
+
+    def plan(self, idle) -> str:
+        """Returns "full", "coarse" or "skip" for next frame"""
+        self.n_frames += 1
+        if not idle:
+            self.count = 0
+            return "full"
+        self.count += 1
+        if (self.count - 1) % self.interval:
+            self.n_skip += 1
+            return "skip"
+        return "coarse"
+
+    def add_time(self, action, dt) -> None:
+        if action == "full":
+            self.n_full += 1
+            self.t_full += dt
+        else:
+            self.n_coarse += 1
+            self.t_coarse += dt
+
+    def get_saving(self) -> float:
+        """Returns fraction of detection time saved, None if not measurable"""
+        if not self.n_full:
+            return None
+        full_time = self.n_frames * self.t_full / self.n_full
+        return 1 - (self.t_full + self.t_coarse) / full_time
+
+
+class Frame_Gate(object):
+    """Reuses last detection result for frames that did not change
+
+    Frames are compared by a downsampled signature with the frame of the last
+    detection (not the previous frame, so slow drifts are not missed). The
+    max difference is used, a border shift changes a single signature column.
+    """
+
+    def __init__(self, cfg) -> None:
+        super().__init__()
+        cg = cfg.main.frame_gate
+        self.size = tuple(cg.size or (32, 18))
+        self.threshold = cg.threshold
+        self.max_skip = cg.max_skip or 30
+        self.signature = None
+        self.reference = None
+        self.result = None
+        self.skipped = 0
+        # counters
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, img):
+        """Returns cached (border_img, x) if img is unchanged, otherwise None"""
+        self.signature = cv2.resize(img, self.size, interpolation=cv2.INTER_AREA)
+        if (
+            self.result is not None
+            and self.skipped < self.max_skip
+            and self.signature.shape == self.reference.shape
+            and cv2.norm(self.signature, self.reference, cv2.NORM_INF)
+            <= self.threshold
+        ):
+            self.skipped += 1
+            self.hits += 1
+            return self.result
+        self.misses += 1
+        return None
+
+    def store(self, result) -> None:
+        """Keeps detection result of the frame passed to last lookup"""
+        self.reference = self.signature
+        self.result = result
+        self.skipped = 0
+
+
+class Border_Detector(object):
+    """Finds tube border with frozen parameters and preallocated buffers
+
+    Parameters are read from cfg.main once, intermediate images are written
+    into buffers allocated for the first frame (OpenCV dst= reuse), so steady
+    state processing does not allocate full-frame images.
+
+    Args:
+        roi (Roi_Tracker): if given, only a column band around the last
+            detected border is processed, returned x is in full-frame pixels
+        timer (profiler.Stage_Timer): if given, latency of each stage is recorded
+        n_outputs (int): number of border images used in turn, a returned
+            border image stays valid until n_outputs more frames are processed
+
+    With cfg.main.grayscale, the frame is converted to a single channel before
+    any other processing.
+
+    Pixel parameters (hough_line_p threshold / minLineLength / maxLineGap,
+    projection window, roi half_width) are given in display pixels and scaled
+    to the processed frame, so detection at a lower process_scale still finds
+    the same edges.
+    """
+
+    def __init__(self, cfg, roi=None, timer=None, debug=False, n_outputs=4) -> None:
+        super().__init__()
+        cm = cfg.main
+        self.roi = roi
+        self.timer = timer
+        self.debug = debug
+        self.n_outputs = max(1, n_outputs)
+        # frozen parameters
+        self.alpha = cm.scale_abs.alpha
+        self.beta = cm.scale_abs.beta
+        self.blur_ksize = tuple(cm.gauss_blur.ksize)
+        self.blur_sigma = cm.gauss_blur.sigmaX
+        self.canny_t1 = cm.canny.threshold1
+        self.canny_t2 = cm.canny.threshold2
+        # get_border used to pass kernel as tuple, which OpenCV reads as a
+        # column vector, keep the same structuring element
+        self.dilate_kernel = np.array(cm.dilate.kernel, dtype=np.uint8).reshape(-1, 1)
+        self.dilate_iterations = cm.dilate.iterations
+        self.erode_kernel = np.array(cm.erode.kernel, dtype=np.uint8).reshape(-1, 1)
+        self.erode_iterations = cm.erode.iterations
+        self.engine = cm.detector or "hough"
+        self.grayscale = cm.grayscale
+        ch = cm.hough_line_p
+        self.rho = ch.rho
+        self.theta = ch.theta
+        self.hough_threshold = ch.threshold
+        self.min_line_length = ch.minLineLength
+        self.max_line_gap = ch.maxLineGap
+        cp = cm.projection
+        self.min_fraction = cp.min_fraction
+        self.window = cp.window
+        self.set_pixel_scale(1.0)
+        self.line_value = cm.style.line_color[0]
+        # buffers, allocated with first frame
+        self.shape = None
+        self.output_index = 0
+
+    def set_pixel_scale(self, scale) -> None:
+        """Scales pixel parameters by processed / display frame width"""
+        self.hough_params = (
+            self.rho,
+            self.theta,
+            max(1, int(round(self.hough_threshold * scale))),
+            self.min_line_length * scale,
+            self.max_line_gap * scale,
+        )
+        window = max(1, int(round(self.window * scale)))
+        self.projection_params = (self.min_fraction, window)
+        if self.roi is not None:
+            self.roi.set_pixel_scale(scale)
+
+    def allocate(self, shape, out_shape=None) -> None:
+        """Allocates buffers for input frames of shape and outputs of out_shape"""
+        out_shape = out_shape or shape
+        self.set_pixel_scale(shape[1] / out_shape[1])
+        logger.debug(f"Allocating detector buffers for {shape}, output {out_shape}")
+        self.shape = (shape, out_shape[:2])
+        h, w = shape[:2]
+        work_shape = shape
+        if self.grayscale and len(shape) == 3:
+            work_shape = (h, w)
+            self.gray_buf = np.empty(work_shape, dtype=np.uint8)
+        self.adjust_buf = np.empty(work_shape, dtype=np.uint8)
+        self.blur_buf = np.empty(work_shape, dtype=np.uint8)
+        self.canny_buf = np.empty((h, w), dtype=np.uint8)
+        self.dilate_buf = np.empty((h, w), dtype=np.uint8)
+        self.erode_buf = np.empty((h, w), dtype=np.uint8)
+        self.outputs = []
+        for _ in range(self.n_outputs):
+            out = np.ones((out_shape[0], out_shape[1], 3), dtype=np.uint8)
+            out[:, :, 2] = 0
+            self.outputs.append(out)
+        self.output_x = [None] * self.n_outputs
+
+    def detect(self, img, out_shape=None):
+        """Finds tube border in image
+
+        Args:
+            out_shape (tuple): shape of the display frame, if it differs from
+                img (processing at lower resolution), border image is created
+                in this shape and x is mapped to its pixels
+
+        Returns:
+            tuple: (border_img, x), x is None if no border is found
+        """
+        timer = self.timer
+        debug = self.debug
+        if timer:
+            t = time.perf_counter()
+        out_shape = out_shape or img.shape
+        if self.shape != (img.shape, out_shape[:2]):
+            self.allocate(img.shape, out_shape)
+        x0, x1 = 0, img.shape[1]
+        x_scale = out_shape[1] / img.shape[1]
+        if self.roi is not None:
+            x0, x1 = self.roi.get_band(img.shape[1])
+            img = img[:, x0:x1]
+        w = x1 - x0
+
+        if self.grayscale and img.ndim == 3:
+            gray = self.gray_buf[:, :w]
+            cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=gray)
+            img = gray
+            if timer:
+                t = timer.lap("gray", t)
+
+        adjust = self.adjust_buf[:, :w]
+        cv2.convertScaleAbs(img, dst=adjust, alpha=self.alpha, beta=self.beta)
+        if timer:
+            t = timer.lap("adjust", t)
+        if debug:
+            cv2.imshow("Debug: Adjust", adjust)
+
+        blur = self.blur_buf[:, :w]
+        cv2.GaussianBlur(adjust, self.blur_ksize, dst=blur, sigmaX=self.blur_sigma)
+        if timer:
+            t = timer.lap("blur", t)
+        if debug:
+            cv2.imshow("Debug: Blur", blur)
+
+        edges = self.canny_buf[:, :w]
+        cv2.Canny(blur, self.canny_t1, self.canny_t2, edges=edges)
+        if timer:
+            t = timer.lap("canny", t)
+        if debug:
+            cv2.imshow("Debug: Canny", edges)
+
+        dilated = self.dilate_buf[:, :w]
+        cv2.dilate(
+            edges, self.dilate_kernel, dst=dilated, iterations=self.dilate_iterations
+        )
+        if timer:
+            t = timer.lap("dilate", t)
+        if debug:
+            cv2.imshow("Debug: Dilate", dilated)
+
+        eroded = self.erode_buf[:, :w]
+        cv2.erode(dilated, self.erode_kernel, dst=eroded, iterations=self.erode_iterations)
+        if timer:
+            t = timer.lap("erode", t)
+        if debug:
+            cv2.imshow("Debug: Erode", eroded)
 
-    img = cv2.convertScaleAbs(img, alpha=cm.scale_abs.alpha, beta=cm.scale_abs.beta)
-    if debug:
-        cv2.imshow("Debug: Adjust", img)
+        if self.engine == "projection":
+            x, n_lines = find_edge_projection(eroded, *self.projection_params)
+        else:
+            x, n_lines = find_edge_hough(eroded, *self.hough_params)
+        if timer:
+            t = timer.lap(self.engine, t)
+        if x is not None:
+            x += x0
+        if self.roi is not None:
+            self.roi.update(x, n_lines)
+        if x is not None and x_scale != 1:
+            # map pixel centers of processing frame to display frame
+            x = (x + 0.5) * x_scale - 0.5
+
+        border_img = self.draw_border(x)
+        if timer:
+            timer.lap("draw", t)
+        return (border_img, x)
+
+    def draw_border(self, x):
+        """Returns next output image with border line drawn in red channel"""
+        i = self.output_index
+        self.output_index = (i + 1) % self.n_outputs
+        out = self.outputs[i]
+        h = out.shape[0]
+        # only erase previous line instead of clearing whole image
+        last_x = self.output_x[i]
+        if last_x is not None:
+            cv2.line(out, (last_x, 0), (last_x, h - 1), (1, 1, 0), 2)
+        if x is not None:
+            xi = int(round(x))
+            cv2.line(out, (xi, 0), (xi, h - 1), (1, 1, self.line_value), 2)
+            self.output_x[i] = xi
+        else:
+            self.output_x[i] = None
+        return out
 
-    img = cv2.GaussianBlur(img, tuple(cm.gauss_blur.ksize), sigmaX=cm.gauss_blur.sigmaX)
-    if debug:
-        cv2.imshow("Debug: Blur", img)
 
-    img = cv2.Canny(img, threshold1=cm.canny.threshold1, threshold2=cm.canny.threshold2)
-    if debug:
-        cv2.imshow("Debug: Canny", img)
+def get_border(img, cfg, debug=False, roi=None, timer=None):
+    """Finds tube border in image
+
+    Compatibility wrapper of Border_Detector, builds a new detector on each call.
+    Keep a Border_Detector instance to process a stream of frames.
+
+    Returns:
+        tuple: (border_img, x), x is None if no border is found
+    """
+    detector = Border_Detector(cfg, roi=roi, timer=timer, debug=debug, n_outputs=1)
+    border_img, x = detector.detect(img)
+    return (border_img, x)
 
-    img = cv2.dilate(img, tuple(cm.dilate.kernel), iterations=cm.dilate.iterations)
-    if debug:
-        cv2.imshow("Debug: Dilate", img)
 
-    img = cv2.erode(img, tuple(cm.erode.kernel), iterations=cm.erode.iterations)
-    if debug:
-        cv2.imshow("Debug: Erode", img)
+def find_edge_hough(edge_img, rho, theta, threshold, min_line_length, max_line_gap):
+    """Finds border with probabilistic Hough transform
 
-    border_img = np.copy(img) * 0
+    Args:
+        rho, theta, threshold, min_line_length, max_line_gap: parameters of
+            cv2.HoughLinesP (cfg.main.hough_line_p)
+
+    Returns:
+        tuple: (x, n_lines), x is the average x of all the lines found
+    """
     lines = cv2.HoughLinesP(
-        img,
-        cm.hough_line_p.rho,
-        cm.hough_line_p.theta,
-        cm.hough_line_p.threshold,
-        lines=np.array([]),
-        minLineLength=cm.hough_line_p.minLineLength,
-        maxLineGap=cm.hough_line_p.maxLineGap,
+        edge_img,
+        rho,
+        theta,
+        threshold,
+        minLineLength=min_line_length,
+        maxLineGap=max_line_gap,
     )
-    x = None
-    if lines is not None:
-        # find average x corodinate among all the lines found
-        x = int(np.average(lines[:, :, [0, 2]]))
-        cv2.line(border_img, (x, 0), (x, img.shape[0] - 1), cm.style.line_color, 2)
-    pad = np.ones(border_img.shape, dtype=border_img.dtype)
-    border_img = cv2.merge((pad, pad, border_img))
+    if lines is None:
+        return None, 0
+    # find average x corodinate among all the lines found
+    return int(np.average(lines[:, :, [0, 2]])), len(lines)
 
-    return (border_img, x)
+
+def find_edge_projection(edge_img, min_fraction, window):
+    """Finds near-vertical border by projecting edge map onto columns
+
+    The column with most edge pixels is taken as peak, then refined to
+    sub-pixel precision with the centroid of the profile around the peak.
+
+    Args:
+        min_fraction (float): minimum fraction of rows with an edge pixel in
+            the peak column (cfg.main.projection)
+        window (int): half width of the centroid window in pixels
+
+    Returns:
+        tuple: (x, n_peaks), x is None (n_peaks = 0) if peak is too weak
+    """
+    profile = np.count_nonzero(edge_img, axis=0)
+    peak = int(np.argmax(profile))
+    if profile[peak] < min_fraction * edge_img.shape[0]:
+        return None, 0
+    lo = max(0, peak - window)
+    hi = min(len(profile), peak + window + 1)
+    weights = profile[lo:hi]
+    x = float(np.dot(np.arange(lo, hi), weights) / weights.sum())
+    return x, 1